@@ -0,0 +1,26 @@
+-- ESTADÍSTICAS DE ENVÍO EN LOTE
+-- Ejecutar en Supabase SQL Editor
+-- Reemplaza el SELECT + UPDATE por destinatario de scripts/send_emails.py:
+-- una sola llamada RPC incrementa total_emails_sent para muchos usuarios
+
+CREATE OR REPLACE FUNCTION increment_email_stats(p_emails TEXT[], p_sent_at TIMESTAMPTZ DEFAULT NOW())
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH counts AS (
+        SELECT email, COUNT(*) AS sent
+        FROM unnest(p_emails) AS email
+        GROUP BY email
+    ), updated AS (
+        UPDATE users u
+        SET total_emails_sent = COALESCE(u.total_emails_sent, 0) + c.sent,
+            last_email_sent_at = GREATEST(COALESCE(u.last_email_sent_at, p_sent_at), p_sent_at),
+            updated_at = NOW()
+        FROM counts c
+        WHERE u.email = c.email
+        RETURNING u.id
+    )
+    SELECT COUNT(*)::INTEGER FROM updated;
+$$;
+
+-- El join por email usa el índice de la restricción UNIQUE de users.email
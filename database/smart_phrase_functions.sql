@@ -0,0 +1,130 @@
+-- FUNCIONES DEL SISTEMA ANTI-REPETICIÓN DE FRASES
+-- Ejecutar en Supabase SQL Editor
+-- Usadas por scripts/smart_phrase_system.py; si no existen, el script
+-- vuelve a las llamadas anteriores (get_smart_phrase_for_user + record_phrase_sent)
+
+-- Selecciona una frase no enviada al usuario y registra el envío en la misma llamada:
+-- un solo round trip por correo y sin ventana para elegir dos veces la misma frase.
+-- Al completar el ciclo recorta el historial a los últimos 50 envíos (igual que
+-- cleanup_user_history) antes de elegir, así la anti-repetición sigue activa
+CREATE OR REPLACE FUNCTION get_and_record_smart_phrase(p_user_id UUID, p_plan_id INTEGER DEFAULT NULL)
+RETURNS TABLE (phrase_id UUID, phrase_text TEXT, phrase_author TEXT)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    v_keep_last CONSTANT INTEGER := 50;
+    v_id UUID;
+    v_text TEXT;
+    v_author TEXT;
+BEGIN
+    SELECT p.id, p.text, p.author INTO v_id, v_text, v_author
+    FROM phrases p
+    WHERE NOT EXISTS (
+        SELECT 1 FROM user_phrase_history h
+        WHERE h.user_id = p_user_id
+          AND h.phrase_id = p.id
+          AND h.email_status = 'sent'
+    )
+    ORDER BY random()
+    LIMIT 1;
+
+    IF NOT FOUND THEN
+        -- Ciclo completo: conservar solo los últimos envíos del usuario
+        DELETE FROM user_phrase_history
+        WHERE user_id = p_user_id
+          AND id NOT IN (
+              SELECT id FROM user_phrase_history
+              WHERE user_id = p_user_id
+              ORDER BY sent_at DESC
+              LIMIT v_keep_last
+          );
+
+        -- Elegir entre las frases fuera de esos últimos envíos
+        SELECT p.id, p.text, p.author INTO v_id, v_text, v_author
+        FROM phrases p
+        WHERE NOT EXISTS (
+            SELECT 1 FROM user_phrase_history h
+            WHERE h.user_id = p_user_id
+              AND h.phrase_id = p.id
+              AND h.email_status = 'sent'
+        )
+        ORDER BY random()
+        LIMIT 1;
+
+        -- Catálogo de 50 frases o menos: cualquiera
+        IF NOT FOUND THEN
+            SELECT p.id, p.text, p.author INTO v_id, v_text, v_author
+            FROM phrases p
+            ORDER BY random()
+            LIMIT 1;
+        END IF;
+
+        IF NOT FOUND THEN
+            RETURN;  -- No hay frases
+        END IF;
+    END IF;
+
+    INSERT INTO user_phrase_history (user_id, phrase_id, email_status, plan_id, sent_at)
+    VALUES (p_user_id, v_id, 'sent', p_plan_id, NOW())
+    ON CONFLICT (user_id, phrase_id) DO UPDATE
+    SET email_status = 'sent',
+        sent_at = EXCLUDED.sent_at,
+        plan_id = COALESCE(EXCLUDED.plan_id, user_phrase_history.plan_id);
+
+    RETURN QUERY SELECT v_id, v_text, v_author;
+END;
+$$;
+
+-- Frases no enviadas al usuario, al azar: el anti-join se resuelve en Postgres
+-- y solo viajan p_limit filas (fallback Python de smart_phrase_system.py)
+CREATE OR REPLACE FUNCTION select_unsent_random(p_user_id UUID, p_limit INTEGER DEFAULT 1)
+RETURNS TABLE (id UUID, text TEXT, author TEXT)
+LANGUAGE sql
+AS $$
+    SELECT p.id, p.text::TEXT, p.author::TEXT
+    FROM phrases p
+    WHERE NOT EXISTS (
+        SELECT 1 FROM user_phrase_history h
+        WHERE h.user_id = p_user_id
+          AND h.phrase_id = p.id
+          AND h.email_status = 'sent'
+    )
+    ORDER BY random()
+    LIMIT p_limit;
+$$;
+
+-- Limpieza del historial al reiniciar el ciclo: conserva los últimos p_keep_last
+-- envíos del usuario y borra el resto en un solo DELETE. Devuelve las filas borradas
+CREATE OR REPLACE FUNCTION cleanup_user_history(p_user_id UUID, p_keep_last INTEGER DEFAULT 50)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH deleted AS (
+        DELETE FROM user_phrase_history
+        WHERE user_id = p_user_id
+          AND id NOT IN (
+              SELECT id FROM user_phrase_history
+              WHERE user_id = p_user_id
+              ORDER BY sent_at DESC
+              LIMIT p_keep_last
+          )
+        RETURNING id
+    )
+    SELECT COUNT(*)::INTEGER FROM deleted;
+$$;
+
+-- Estadísticas de frases de un usuario en una sola fila (sin traer el historial)
+CREATE OR REPLACE FUNCTION get_user_phrase_stats(p_user_id UUID)
+RETURNS TABLE (total_phrases INTEGER, phrases_received INTEGER, last_sent_at TIMESTAMPTZ)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        (SELECT COUNT(*)::INTEGER FROM phrases),
+        COUNT(*)::INTEGER,
+        MAX(h.sent_at)::TIMESTAMPTZ
+    FROM user_phrase_history h
+    WHERE h.user_id = p_user_id
+      AND h.email_status = 'sent';
+$$;
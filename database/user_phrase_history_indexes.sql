@@ -0,0 +1,18 @@
+-- ÍNDICES DE user_phrase_history
+-- Ejecutar en Supabase SQL Editor
+-- Cubren las consultas calientes de scripts/smart_phrase_system.py:
+-- anti-join de frases no enviadas, conteo de estadísticas y limpieza del historial
+--
+-- Sin CONCURRENTLY: el SQL Editor ejecuta el script dentro de una transacción.
+-- Con la tabla actual (cientos de filas) el bloqueo dura milisegundos; si crece mucho,
+-- ejecutar cada sentencia por separado con CREATE INDEX CONCURRENTLY.
+
+-- Igualdades más selectivas primero (user_id, email_status) y phrase_id para el
+-- NOT EXISTS; sent_at incluido para responder desde el índice (index-only scan)
+CREATE INDEX IF NOT EXISTS idx_uph_user_status_phrase
+    ON user_phrase_history (user_id, email_status, phrase_id)
+    INCLUDE (sent_at);
+
+-- Últimos N envíos por usuario (ORDER BY sent_at DESC LIMIT N en cleanup_user_history)
+CREATE INDEX IF NOT EXISTS idx_uph_user_sent_at
+    ON user_phrase_history (user_id, sent_at DESC);
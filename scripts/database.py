@@ -9,7 +9,7 @@ UPDATED FOR 2025 DELIVERABILITY-SAFE FREEMIUM MODEL (Plan ID = Emails por día):
 - Plan 13: Premium Power User 13/día (1h = VIP/manual)
 """
 import os
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional
 from dataclasses import dataclass
 from datetime import datetime, timezone
 import structlog
@@ -17,6 +17,9 @@ from supabase import create_client, Client
 
 logger = structlog.get_logger()
 
+# Filas por página al leer suscripciones (<= max-rows de PostgREST, 1000 por defecto)
+SUBSCRIBERS_PAGE_SIZE = 1000
+
 @dataclass
 class User:
     id: str
@@ -215,23 +218,41 @@ class SupabaseManager:
             logger.error("Failed to get subscription plan", plan_id=plan_id, error=str(e))
             return None
     
-    def get_all_active_subscribers(self) -> List[Dict[str, any]]:
-        """Get all users with active subscriptions and their plan details"""
-        try:
-            response = self.supabase.table('subscriptions').select(
-                '*, users!inner(id, email), subscription_plans!inner(*)'
-            ).eq('status', 'active').execute()
-            
-            subscribers = []
-            for data in response.data:
-                subscribers.append({
+    def iter_active_subscribers(self, frequency_hours: Optional[List[int]] = None) -> Iterator[Dict[str, any]]:
+        """
+        Yield users with active subscriptions and their plan details, page by page.
+        Pages of SUBSCRIBERS_PAGE_SIZE rows (orden estable por id) via .range(): PostgREST
+        corta las respuestas en max-rows, y así cada página se procesa mientras llega la siguiente.
+        frequency_hours: si se pasa, Postgres filtra por plan y solo devuelve esas filas
+        """
+        start = 0
+        while True:
+            # El builder acumula parámetros: se arma uno nuevo por página
+            query = self.supabase.table('subscriptions').select(
+                'id, users!inner(id, email), subscription_plans!inner(frequency_hours, name, max_emails_per_day)'
+            ).eq('status', 'active')
+            if frequency_hours is not None:
+                query = query.in_('subscription_plans.frequency_hours', list(frequency_hours))
+            rows = query.order('id').range(start, start + SUBSCRIBERS_PAGE_SIZE - 1).execute().data or []
+            for data in rows:
+                yield {
                     'user_id': data['users']['id'],  # NUEVO: ID del usuario para anti-repetición
                     'email': data['users']['email'],
                     'frequency_hours': data['subscription_plans']['frequency_hours'],
                     'plan_name': data['subscription_plans']['name'],
                     'max_emails_per_day': data['subscription_plans']['max_emails_per_day']
-                })
-            
+                }
+            if len(rows) < SUBSCRIBERS_PAGE_SIZE:
+                return
+            start += SUBSCRIBERS_PAGE_SIZE
+    
+    def get_all_active_subscribers(self, frequency_hours: Optional[List[int]] = None) -> List[Dict[str, any]]:
+        """
+        Get all users with active subscriptions and their plan details.
+        frequency_hours: si se pasa, Postgres filtra por plan y solo devuelve esas filas
+        """
+        try:
+            subscribers = list(self.iter_active_subscribers(frequency_hours))
             logger.info("Retrieved active subscribers with user_ids", count=len(subscribers))
             return subscribers
             
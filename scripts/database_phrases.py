@@ -8,8 +8,11 @@ MIGRACIÓN SUAVE:
 2. Renombrar este archivo a database_phrases.py  
 3. ¡Listo! El sistema funciona automáticamente sin repeticiones
 """
+import functools
 import os
 import random
+import threading
+import time
 from typing import Dict, List, Optional
 from supabase import create_client
 import structlog
@@ -31,13 +34,28 @@ except ImportError:
     
 logger = structlog.get_logger()
 
-def get_supabase_client():
-    """Get Supabase client for phrases - UNCHANGED"""
+# Solo las columnas que usamos: filas más pequeñas en la respuesta y al parsear
+PHRASE_COLUMNS = 'id, text, author'
+
+# El catálogo cambia poco: el conteo se reutiliza durante la hora en curso
+PHRASE_COUNT_TTL_SECONDS = 3600
+_phrase_count_cache: Dict[str, int] = {}
+
+# lru_cache no serializa la primera llamada: el lock evita un cliente por hilo del pool
+_supabase_client_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _create_supabase_client():
     return create_client(
         os.getenv('SUPABASE_URL'),
         os.getenv('SUPABASE_KEY')
     )
 
+def get_supabase_client():
+    """Get Supabase client for phrases (uno por proceso: reutiliza conexión y TLS)"""
+    with _supabase_client_lock:
+        return _create_supabase_client()
+
 # =====================================================
 # FUNCIONES PRINCIPALES - ENHANCED CON INTELIGENCIA
 # =====================================================
@@ -82,17 +100,15 @@ def _get_original_random_phrase() -> Optional[Dict]:
     Usado como fallback y para compatibilidad
     """
     try:
-        supabase = get_supabase_client()
-        
-        # Obtener todas las frases (o usar LIMIT para performance)
-        result = supabase.table('phrases').select('*').execute()
-        
-        if not result.data:
+        # Elegir un índice al azar y traer solo esa fila (no todo el catálogo)
+        total = get_phrase_count_cached()
+        if not total:
             logger.warning("No phrases found in database")
             return None
             
-        # Seleccionar frase aleatoria
-        phrase = random.choice(result.data)
+        phrase = load_phrase_at(random.randrange(total))
+        if not phrase:
+            return None
         
         logger.info(
             "Random phrase selected (original mode)",
@@ -101,11 +117,7 @@ def _get_original_random_phrase() -> Optional[Dict]:
             text_length=len(phrase['text'])
         )
         
-        return {
-            'id': phrase['id'],
-            'text': phrase['text'],
-            'author': phrase['author']
-        }
+        return phrase
         
     except Exception as e:
         logger.error("Error getting random phrase from database", error=str(e))
@@ -120,7 +132,7 @@ def get_phrase_by_author(author: str) -> Optional[Dict]:
     try:
         supabase = get_supabase_client()
         
-        result = supabase.table('phrases').select('*').eq('author', author).execute()
+        result = supabase.table('phrases').select(PHRASE_COLUMNS).eq('author', author).execute()
         
         if not result.data:
             logger.warning("No phrases found for author", author=author)
@@ -142,12 +154,51 @@ def get_phrase_count() -> int:
     """Obtiene el total de frases en la base de datos - UNCHANGED"""
     try:
         supabase = get_supabase_client()
-        result = supabase.table('phrases').select('*', count='exact').execute()
+        # Solo necesitamos el conteo: pedir 1 fila en vez de toda la tabla
+        result = supabase.table('phrases').select('id', count='exact').limit(1).execute()
         return result.count or 0
     except Exception as e:
         logger.error("Error counting phrases", error=str(e))
         return 0
 
+def get_phrase_count_cached() -> int:
+    """
+    Conteo de frases reutilizado dentro de la misma hora (PHRASE_COUNT_TTL_SECONDS)
+    Evita un COUNT por cada correo del fallback aleatorio; los errores (0) no se cachean
+    """
+    bucket = int(time.time() // PHRASE_COUNT_TTL_SECONDS)
+    if _phrase_count_cache.get('bucket') == bucket:
+        return _phrase_count_cache['count']
+    
+    count = get_phrase_count()
+    if count:
+        _phrase_count_cache.update(bucket=bucket, count=count)
+    return count
+
+def load_phrase_at(index: int) -> Optional[Dict]:
+    """
+    Obtiene solo la frase en la posición `index` (orden estable por id)
+    Evita materializar todo el catálogo cuando solo se necesita una frase
+    """
+    try:
+        supabase = get_supabase_client()
+        result = supabase.table('phrases').select(PHRASE_COLUMNS).order('id').range(index, index).execute()
+        
+        if not result.data:
+            logger.warning("No phrase found at index", index=index)
+            return None
+            
+        row = result.data[0]
+        return {
+            'id': str(row['id']),
+            'text': row['text'],
+            'author': row['author']
+        }
+        
+    except Exception as e:
+        logger.error("Error loading phrase by index", index=index, error=str(e))
+        return None
+
 def get_authors_list() -> List[str]:
     """Obtiene lista única de autores - UNCHANGED"""
     try:
@@ -171,7 +222,7 @@ def load_phrases() -> List[Dict]:
     """
     try:
         supabase = get_supabase_client()
-        result = supabase.table('phrases').select('*').execute()
+        result = supabase.table('phrases').select(PHRASE_COLUMNS).execute()
         
         if not result.data:
             logger.warning("No phrases found in database")
@@ -1,18 +1,26 @@
-import csv
 import hashlib
+import json
 import os
+import re
+import string
 import sys
-import requests
-from datetime import datetime, timezone
-from typing import List, Dict, Optional, Tuple, Literal
+import importlib
+import itertools
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Iterator, Optional, Tuple, Literal
 from dataclasses import dataclass, field
 from enum import IntEnum
 import time
-import secrets
+import threading
+import queue
 import hmac
+import atexit
+import functools
 import logging
 import structlog
 from pathlib import Path
+from html import escape as html_escape
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Import Supabase database module
 try:
@@ -31,10 +39,15 @@ except ImportError:
     Field = lambda **kwargs: None
 
 # Configure structured logging
+# LOG_LEVEL=WARNING drops per-recipient info events at the first processor (filter_by_level)
+# LOG_FORMAT=kv uses the cheaper key=value renderer instead of JSON
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+
 logging.basicConfig(
     format="%(message)s",
     stream=sys.stdout,
-    level=logging.INFO,
+    level=getattr(logging, LOG_LEVEL, logging.INFO),
 )
 
 structlog.configure(
@@ -47,7 +60,8 @@ structlog.configure(
         structlog.processors.StackInfoRenderer(),
         structlog.processors.format_exc_info,
         structlog.processors.UnicodeDecoder(),
-        structlog.processors.JSONRenderer()
+        structlog.processors.KeyValueRenderer(sort_keys=False) if LOG_FORMAT == 'kv'
+        else structlog.processors.JSONRenderer()
     ],
     context_class=dict,
     logger_factory=structlog.stdlib.LoggerFactory(),
@@ -65,16 +79,150 @@ except ImportError:
     logger.warning("dotenv not installed - environment variables from shell only")
 
 
-# Optional import: if resend is not installed, allow dry-run
+@functools.lru_cache(maxsize=None)
+def _lazy(module_name: str):
+    """
+    Import a heavy module on first use only (requests pulls in urllib3,
+    certifi, ...). Dry-runs that never hit the network skip that cost.
+    """
+    return importlib.import_module(module_name)
+
+# Optional import: orjson parses Netlify payloads straight from bytes and
+# serializes Resend payloads (faster)
 try:
-    import resend  # type: ignore
-except ImportError as e:
-    logger.warning("Resend not installed - dry-run only", error=str(e))
-    resend = None  # type: ignore
+    import orjson  # type: ignore
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads  # also accepts bytes, no separate decode step
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
 
 
 NETLIFY_API = "https://api.netlify.com/api/v1"
 
+REPLY_TO_ADDRESS = "reflexiones@pseudosapiens.com"
+
+# Hora de Perú (UTC-5, sin horario de verano)
+PERU_TZ = timezone(timedelta(hours=-5))
+
+# Headers para BIMI - Branding y Logo (Sep 2025), iguales en todos los envíos
+BRANDING_HEADERS = {
+    "X-Mailer": "Pseudosapiens Email System v2.0",
+    "Organization": "Pseudosapiens",
+    "X-Brand-Logo": "https://pseudosapiens.com/favicon.svg",
+    "X-Original-From": "Pseudosapiens <reflexiones@pseudosapiens.com>",
+    "X-Company": "Pseudosapiens",
+}
+
+RESEND_API = "https://api.resend.com"
+
+# Resend batch endpoint accepts at most 100 emails per call
+RESEND_BATCH_SIZE = 100
+
+# Resend calls allowed in flight at once (pacing still comes from the token bucket)
+RESEND_MAX_IN_FLIGHT = int(os.getenv('RESEND_MAX_IN_FLIGHT', '2'))
+NETLIFY_PER_PAGE = 100
+NETLIFY_PAGE_CONCURRENCY = 4
+# Suscriptores preparados en paralelo (frase en Supabase + asunto en OpenAI: trabajo de I/O)
+CONTENT_BUILD_WORKERS = int(os.getenv('CONTENT_BUILD_WORKERS', '8'))
+
+# Local cache directory shared by subscriber lists and sent-slot markers
+CACHE_DIR = Path(os.getenv('EMAIL_CACHE_DIR', str(Path(__file__).parent / '.cache')))
+
+# Local cache for the Netlify subscriber list (subscribers rarely change within hours)
+NETLIFY_CACHE_DIR = Path(os.getenv('NETLIFY_CACHE_DIR', str(CACHE_DIR)))
+
+# Netlify HTTP responses kept for ETag revalidation (If-None-Match -> 304)
+NETLIFY_HTTP_CACHE_DIR = NETLIFY_CACHE_DIR / 'http'
+
+# Markers for hour slots already sent, so CI reruns don't resend the same slot
+SENT_MARKERS_DIR = CACHE_DIR / 'sent'
+SENT_MARKER_MAX_AGE_SECONDS = 48 * 3600
+NETLIFY_CACHE_TTL_SECONDS = int(os.getenv('NETLIFY_CACHE_TTL_SECONDS', '21600'))  # 6 horas
+
+
+@functools.lru_cache(maxsize=None)
+def _get_netlify_session():
+    """Pooled session so consecutive Netlify calls reuse the same TCP+TLS connection."""
+    requests = _lazy('requests')
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False,
+    )
+    # One host (api.netlify.com); keep exactly one connection per concurrent page fetch
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=NETLIFY_PAGE_CONCURRENCY,
+        pool_block=True,
+        max_retries=retry,
+    )
+    session.mount("https://", adapter)
+    atexit.register(session.close)
+    return session
+
+
+@functools.lru_cache(maxsize=4)
+def _auth_headers(token: str) -> Dict[str, str]:
+    """Authorization headers for Netlify, built once per token."""
+    return {"Authorization": f"Bearer {token}"}
+
+# Cheap shape check for submitted emails (full validation happens in Subscriber)
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+# Suppression list: addresses that bounced permanently or must not be mailed again.
+# One email per line; consulted before every batch so dead addresses cost no API calls.
+# Lives under CACHE_DIR so the CI cache step (scripts/.cache) carries it between runs.
+SUPPRESSION_FILE = Path(os.getenv('SUPPRESSION_FILE', str(CACHE_DIR / 'suppress.txt')))
+
+# Resend status codes that may mean the address itself will never accept mail.
+# A 422 only counts as permanent when the error body names the recipient:
+# payload problems (bad from, headers, tags) come back as 422 too.
+PERMANENT_FAILURE_STATUS_CODES = (422,)
+
+
+def load_suppression_list(path: Path = SUPPRESSION_FILE) -> set:
+    """Load suppressed emails from disk (empty set if the file does not exist)."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return {line.strip().lower() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+    except OSError as e:
+        logger.warning("Could not read suppression list", path=str(path), error=str(e))
+        return set()
+
+
+_SUPPRESSED = load_suppression_list()
+
+
+def is_suppressed(email: str) -> bool:
+    """Check whether an email is on the suppression list."""
+    return email.lower() in _SUPPRESSED
+
+
+def suppress_email(email: str, reason: str = "") -> None:
+    """Add an email to the suppression list and persist it."""
+    email = email.strip().lower()
+    if not email or email in _SUPPRESSED:
+        return
+    _SUPPRESSED.add(email)
+    try:
+        SUPPRESSION_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(SUPPRESSION_FILE, 'a', encoding='utf-8') as f:
+            f.write(email + "\n")
+        logger.info("Email added to suppression list", email=email, reason=reason)
+    except OSError as e:
+        logger.warning("Could not persist suppressed email", email=email, error=str(e))
+
 
 # =============================================================================
 # CONFIGURATION MODELS (Dataclasses & Pydantic)
@@ -94,6 +242,20 @@ class FrequencyEnum(IntEnum):
     FLOW_STATE = 4  # Legacy
 
 
+# Frecuencias válidas del modelo 2025 (Plan ID = Emails por día)
+PLAN_FREQUENCIES = (1, 6, 8, 12, 24, 56)
+
+# frequency_hours de subscription_plans -> FrequencyEnum
+_FREQ_BY_PLAN_HOURS: Dict[int, FrequencyEnum] = {
+    56: FrequencyEnum.FREE_WEEKLY_3,  # Plan 0 - Gratuito (3/semana L-M-V)
+    24: FrequencyEnum.DAILY,          # Plan 1 - Premium 1/día
+    12: FrequencyEnum.TWICE_DAILY,    # Plan 2 - Premium 2/día
+    8: FrequencyEnum.THREE_DAILY,     # Plan 3 - Premium 3/día
+    6: FrequencyEnum.EVERY_6_HOURS,   # Plan 4 - Premium 4/día
+    1: FrequencyEnum.HOURLY,          # Plan 13 - Power User (13/día manual/VIP)
+}
+
+
 @dataclass(frozen=True)
 class EmailConfig:
     """Email service configuration."""
@@ -158,7 +320,7 @@ class Subscriber(BaseModel):
             except ValueError:
                 raise ValueError(f"Invalid frequency: {v}")
         
-        if v not in [1, 6, 8, 12, 24, 56]:  # NEW 2025 MODEL values
+        if v not in PLAN_FREQUENCIES:  # NEW 2025 MODEL values
             raise ValueError(f"Frequency must be 1, 6, 8, 12, 24, or 56 (new model), got: {v}")
         
         return FrequencyEnum(v)
@@ -201,26 +363,33 @@ class EmailContent(BaseModel):
 # CORE BUSINESS LOGIC
 # =============================================================================
 
+@functools.lru_cache(maxsize=None)
+def _unsubscribe_mac():
+    """BLAKE2b-128 con clave (MAC nativo, sin envoltorio HMAC); se copia por token."""
+    # Usar una clave secreta del entorno o generar una por defecto
+    secret_key = os.getenv('UNSUBSCRIBE_SECRET', 'pseudosapiens-default-secret-2025').encode('utf-8')
+    # BLAKE2b admite claves de hasta 64 bytes; secretos más largos se reducen con un hash
+    if len(secret_key) > hashlib.blake2b.MAX_KEY_SIZE:
+        secret_key = hashlib.blake2b(secret_key).digest()
+    return hashlib.blake2b(key=secret_key, digest_size=16)
+
+
+def _unsubscribe_signature(email: str, timestamp: str) -> str:
+    h = _unsubscribe_mac().copy()
+    h.update(f"{email}:{timestamp}".encode('utf-8'))
+    return h.hexdigest()
+
+
 def generate_unsubscribe_token(email: str) -> str:
     """
     Genera un token seguro para desuscripción.
     Combina email + timestamp + secret para crear un token único y verificable.
     """
-    # Usar una clave secreta del entorno o generar una por defecto
-    secret_key = os.getenv('UNSUBSCRIBE_SECRET', 'pseudosapiens-default-secret-2025')
-    
     # Timestamp actual (válido por 30 días)
     timestamp = str(int(time.time()))
     
-    # Datos a firmar
-    message = f"{email}:{timestamp}"
-    
-    # Generar HMAC
-    signature = hmac.new(
-        secret_key.encode('utf-8'),
-        message.encode('utf-8'),
-        hashlib.sha256
-    ).hexdigest()
+    # Firmar "email:timestamp" (32 caracteres hex)
+    signature = _unsubscribe_signature(email, timestamp)
     
     # Token final: timestamp:signature
     return f"{timestamp}:{signature}"
@@ -234,25 +403,14 @@ def validate_unsubscribe_token(email: str, token: str) -> bool:
         timestamp_str, signature = token.split(':', 1)
         timestamp = int(timestamp_str)
         
-        # Verificar que no haya expirado (30 días = 2592000 segundos)
-        current_time = int(time.time())
-        if current_time - timestamp > 2592000:  # 30 días
-            return False
-        
-        # Regenerar el token esperado
-        expected_token = generate_unsubscribe_token(email)
-        expected_timestamp, expected_signature = expected_token.split(':', 1)
+        # Vigencia de 30 días (2592000 segundos); se evalúa siempre, sin salida
+        # temprana, para que un token vencido y uno inválido tarden lo mismo
+        not_expired = int(time.time()) - timestamp <= 2592000
         
         # Comparar signatures de forma segura (no el timestamp, que será diferente)
-        secret_key = os.getenv('UNSUBSCRIBE_SECRET', 'pseudosapiens-default-secret-2025')
-        message = f"{email}:{timestamp_str}"
-        expected_sig = hmac.new(
-            secret_key.encode('utf-8'),
-            message.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
+        expected_sig = _unsubscribe_signature(email, timestamp_str)
         
-        return hmac.compare_digest(signature, expected_sig)
+        return hmac.compare_digest(signature, expected_sig) & not_expired
         
     except (ValueError, IndexError):
         return False
@@ -262,17 +420,100 @@ def validate_unsubscribe_token(email: str, token: str) -> bool:
 # See scripts/database_phrases.py for phrase loading functions
 
 
-def current_hour_slot() -> int:
+def current_hour_slot(now: Optional[float] = None) -> int:
     """Return the current UTC hour slot (epoch hours)."""
-    now = datetime.now(timezone.utc)
-    epoch = int(now.timestamp())
-    return epoch // 3600
+    return int(time.time() if now is None else now) // 3600
+
+
+def slot_send_key(*parts: str) -> str:
+    """Idempotency key identifying one send of a given hour slot."""
+    return hashlib.blake2b("|".join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def idempotency_prefix(subject: str, slot: str):
+    """BLAKE2b-128 state with the invariant 'subject|slot|' prefix already absorbed."""
+    prefix = hashlib.blake2b(digest_size=16)
+    prefix.update(f"{subject}|{slot}|".encode('utf-8'))
+    return prefix
+
 
+def idempotency_key(prefix, recipient: str) -> str:
+    """Per-recipient idempotency key: copy the prefixed state and absorb only the recipient."""
+    h = prefix.copy()
+    h.update(recipient.encode('utf-8'))
+    return h.hexdigest()
 
-def get_optimal_send_hours(frequency: int) -> List[int]:
+
+def rotate_sent_markers(max_age: int = SENT_MARKER_MAX_AGE_SECONDS) -> None:
+    """Delete sent-slot markers older than `max_age` seconds to keep the directory bounded."""
+    cutoff = time.time() - max_age
+    try:
+        for marker in SENT_MARKERS_DIR.glob('*'):
+            if marker.stat().st_mtime < cutoff:
+                marker.unlink()
+    except OSError as e:
+        logger.warning("Could not rotate sent markers", error=str(e))
+
+
+def slot_already_sent(key: str) -> bool:
+    """Check whether a send with this key already completed locally."""
+    return (SENT_MARKERS_DIR / key).exists()
+
+
+def mark_slot_sent(key: str) -> None:
+    """Record a completed send for this key."""
+    try:
+        SENT_MARKERS_DIR.mkdir(parents=True, exist_ok=True)
+        (SENT_MARKERS_DIR / key).touch()
+    except OSError as e:
+        logger.warning("Could not write sent marker", key=key, error=str(e))
+
+
+# Horas de envío (UTC) por plan, precalculadas al importar: Peru = UTC-5
+_HOURS_BY_FREQ: Dict[int, frozenset] = {
+    24: frozenset({13}),              # 8:00 Peru = 13:00 UTC
+    12: frozenset({13, 22}),          # 8:00, 17:00 Peru
+    8: frozenset({13, 19, 1}),        # 8:00, 14:00, 20:00 Peru
+    6: frozenset({13, 17, 22, 2}),    # 8:00, 12:00, 17:00, 21:00 Peru
+    1: frozenset(list(range(13, 24)) + [0, 1]),  # 8:00-20:00 Peru (13 horas)
+}
+# Plan gratuito (y frecuencias no reconocidas): L-M-V a las 8:00 Peru = 13:00 UTC
+_FREE_PLAN_HOURS = frozenset({13})
+_FREE_WEEKDAYS = frozenset({0, 2, 4})  # Monday, Wednesday, Friday
+
+
+@functools.lru_cache(maxsize=32)
+def _optimal_send_hours(frequency: int, weekday: int) -> frozenset:
+    """Horas UTC de envío para (frecuencia, día de la semana); memoizado por combinación."""
+    hours = _HOURS_BY_FREQ.get(frequency)
+    if hours is not None:
+        return hours
+    # Default: plan gratuito para frecuencias no reconocidas (se avisa una vez por combinación)
+    if frequency != 56:
+        logger.warning("Unknown frequency in get_optimal_send_hours, defaulting to free plan", frequency=frequency)
+    return _FREE_PLAN_HOURS if weekday in _FREE_WEEKDAYS else frozenset()
+
+
+# Tabla de envío precalculada al importar: índice weekday*24 + hora UTC,
+# bit f encendido si el plan de frecuencia f envía en esa hora
+_SEND_MASKS: Tuple[int, ...] = tuple(
+    sum(1 << frequency for frequency in PLAN_FREQUENCIES
+        if hour in _optimal_send_hours(frequency, weekday))
+    for weekday in range(7) for hour in range(24)
+)
+_PLAN_FREQUENCY_SET = frozenset(PLAN_FREQUENCIES)
+
+
+def _current_send_mask(now: Optional[datetime] = None) -> int:
+    """Bitmask de planes que envían en la hora UTC actual."""
+    now = now or datetime.now(timezone.utc)
+    return _SEND_MASKS[now.weekday() * 24 + now.hour]
+
+
+def get_optimal_send_hours(frequency: int) -> Tuple[int, ...]:
     """
     Return optimal sending hours for NEW 2025 MODEL (Deliverability-Safe).
-    Returns list of hours (0-23) in UTC.
+    Returns a sorted tuple of hours (0-23) in UTC.
     
     NUEVO MODELO (Plan ID = Emails por día):
     - 56: Plan 0 - Gratuito (3/semana L-M-V, 8:00)
@@ -282,45 +523,7 @@ def get_optimal_send_hours(frequency: int) -> List[int]:
     - 6: Plan 4 - Premium 4/día (8:00, 12:00, 17:00, 21:00)
     - 1: Plan 13 - Power User 13/día (cada hora 8:00-20:00)
     """
-    # Convert Peru time to UTC (Peru = UTC-5)
-    
-    if frequency == 56:  # Plan gratuito (3 por semana L-M-V)
-        # Solo Lunes-Miércoles-Viernes a las 8:00 AM Peru = 13:00 UTC
-        from datetime import datetime, timezone
-        now_utc = datetime.now(timezone.utc)
-        weekday = now_utc.weekday()  # 0=Monday, 1=Tuesday, 2=Wednesday, 6=Sunday
-        
-        if weekday in [0, 2, 4]:  # Monday, Wednesday, Friday
-            return [13]  # 8:00 AM Peru = 13:00 UTC
-        else:
-            return []  # No envíos otros días
-    
-    elif frequency == 24:  # Plan 1 - Premium 1/día
-        return [13]  # 8:00 Peru = 13:00 UTC
-    
-    elif frequency == 12:  # Plan 2 - Premium 2/día 
-        return [13, 22]  # 8:00, 17:00 Peru = 13:00, 22:00 UTC
-    
-    elif frequency == 8:  # Plan 3 - Premium 3/día
-        return [13, 19, 1]  # 8:00, 14:00, 20:00 Peru = 13:00, 19:00, 01:00 UTC
-    
-    elif frequency == 6:  # Plan 4 - Premium 4/día
-        return [13, 17, 22, 2]  # 8:00, 12:00, 17:00, 21:00 Peru = 13:00, 17:00, 22:00, 02:00 UTC
-    
-    elif frequency == 1:  # Plan 13 - Power User 13/día (manual/VIP)
-        # 8:00-20:00 Peru (13 horas) = 13:00-01:00 UTC (next day)  
-        return list(range(13, 24)) + list(range(0, 2))  # 13-23 UTC + 0-1 UTC (total: 13 horas)
-    
-    else:
-        # Default: plan gratuito para frecuencias no reconocidas
-        logger.warning("Unknown frequency in get_optimal_send_hours, defaulting to free plan", frequency=frequency)
-        from datetime import datetime, timezone
-        now_utc = datetime.now(timezone.utc)
-        weekday = now_utc.weekday()
-        if weekday in [0, 2, 4]:  # L-M-V
-            return [13]
-        else:
-            return []
+    return tuple(sorted(_optimal_send_hours(frequency, datetime.now(timezone.utc).weekday())))
 
 
 def should_send_at_current_hour(frequency: int) -> bool:
@@ -331,38 +534,89 @@ def should_send_at_current_hour(frequency: int) -> bool:
     now = datetime.now(timezone.utc)
     current_utc_hour = now.hour
     
-    optimal_hours = get_optimal_send_hours(frequency)
-    result = current_utc_hour in optimal_hours
+    if frequency in _PLAN_FREQUENCY_SET:
+        # Planes conocidos: un lookup en la tabla precalculada
+        result = bool((_current_send_mask(now) >> frequency) & 1)
+    else:
+        result = current_utc_hour in _optimal_send_hours(frequency, now.weekday())
     
     # Extra logging for debugging new model
     if result:
         logger.debug("Should send email", 
                     frequency=frequency, 
                     current_utc_hour=current_utc_hour,
-                    optimal_hours=optimal_hours,
                     weekday=now.weekday())
     
     return result
 
 
-def is_sending_hours() -> bool:
+def frequencies_sending_now(frequencies) -> set:
+    """
+    Decide once per distinct frequency which plans send this hour.
+    Subscribers are then filtered with a set membership test instead of
+    recomputing the hour table for every subscriber.
+    """
+    frequencies = set(frequencies)
+    # Planes conocidos: se leen todos de la máscara de la hora actual de una vez
+    mask = _current_send_mask()
+    sending = {frequency for frequency in frequencies & _PLAN_FREQUENCY_SET if (mask >> frequency) & 1}
+    sending.update(frequency for frequency in frequencies - _PLAN_FREQUENCY_SET
+                   if should_send_at_current_hour(frequency))
+    return sending
+
+
+# Horas UTC de envío como bitmask de 24 bits (bit h = hora h)
+# Peru time = UTC-5, so 5 AM PET = 10 AM UTC, 11:59 PM PET = 4:59 AM UTC (next day)
+_SENDING_HOURS_MASK = sum(1 << hour for hour in (*range(10, 24), *range(0, 5)))
+
+
+def is_sending_hours(now: Optional[float] = None) -> bool:
     """Check if current UTC time corresponds to Peru sending hours (5:00 AM - 11:59 PM PET)."""
-    now = datetime.now(timezone.utc)
-    hour = now.hour
-    # Peru time = UTC-5, so 5 AM PET = 10 AM UTC, 11:59 PM PET = 4:59 AM UTC (next day)
-    return hour >= 10 or hour <= 4
+    return bool((_SENDING_HOURS_MASK >> (current_hour_slot(now) % 24)) & 1)
+
+
+def _cached_get(url: str, token: str, params: Optional[Dict] = None):
+    """
+    GET a Netlify JSON resource with ETag revalidation.
+    The raw body and its ETag are kept on disk; a 304 reuses the cached body
+    instead of downloading it again.
+    """
+    key = hashlib.sha256(f"{url}?{sorted((params or {}).items())}".encode('utf-8')).hexdigest()
+    body_path = NETLIFY_HTTP_CACHE_DIR / f"{key}.body"
+    etag_path = NETLIFY_HTTP_CACHE_DIR / f"{key}.etag"
+    
+    headers = _auth_headers(token)
+    try:
+        etag = etag_path.read_text(encoding='utf-8')
+        headers = {**headers, "If-None-Match": etag}
+    except OSError:
+        etag = None
+    
+    response = _get_netlify_session().get(url, headers=headers, params=params, timeout=30)
+    if response.status_code == 304 and etag:
+        try:
+            return _json_loads(body_path.read_bytes())
+        except OSError:
+            # Cached body vanished: fetch it again unconditionally
+            response = _get_netlify_session().get(url, headers=_auth_headers(token), params=params, timeout=30)
+    response.raise_for_status()
+    
+    new_etag = response.headers.get('ETag')
+    if new_etag:
+        try:
+            NETLIFY_HTTP_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            body_path.write_bytes(response.content)
+            etag_path.write_text(new_etag, encoding='utf-8')
+        except OSError as e:
+            logger.warning("Could not write Netlify HTTP cache", url=url, error=str(e))
+    return _json_loads(response.content)
 
 
 def get_forms(site_id: str, token: str) -> List[Dict[str, any]]:
     """Fetch forms from Netlify with proper error handling."""
+    requests = _lazy('requests')
     try:
-        response = requests.get(
-            f"{NETLIFY_API}/sites/{site_id}/forms",
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=30,
-        )
-        response.raise_for_status()
-        return response.json()
+        return _cached_get(f"{NETLIFY_API}/sites/{site_id}/forms", token)
     except requests.exceptions.Timeout:
         logger.error("Netlify API timeout getting forms", site_id=site_id)
         raise
@@ -375,65 +629,148 @@ def get_forms(site_id: str, token: str) -> List[Dict[str, any]]:
         raise
 
 
-def get_submissions(form_id: str, token: str) -> List[Dict[str, any]]:
-    """Fetch form submissions from Netlify with proper error handling."""
+def _get_submissions_page(form_id: str, token: str, page: int) -> List[Dict[str, any]]:
+    """Fetch a single page of form submissions from Netlify."""
+    requests = _lazy('requests')
     try:
-        response = requests.get(
+        return _cached_get(
             f"{NETLIFY_API}/forms/{form_id}/submissions",
-            headers={"Authorization": f"Bearer {token}"},
-            timeout=30,
+            token,
+            params={"per_page": NETLIFY_PER_PAGE, "page": page},
         )
-        response.raise_for_status()
-        return response.json()
     except requests.exceptions.Timeout:
-        logger.error("Netlify API timeout getting submissions", form_id=form_id)
+        logger.error("Netlify API timeout getting submissions", form_id=form_id, page=page)
         raise
     except requests.exceptions.HTTPError as e:
         logger.error("Netlify API HTTP error getting submissions", 
-                    form_id=form_id, status_code=e.response.status_code)
+                    form_id=form_id, page=page, status_code=e.response.status_code)
         raise
     except requests.exceptions.ConnectionError:
-        logger.error("Netlify API connection error getting submissions", form_id=form_id)
+        logger.error("Netlify API connection error getting submissions", form_id=form_id, page=page)
         raise
 
 
+def iter_submissions(form_id: str, token: str) -> Iterator[Dict[str, any]]:
+    """
+    Yield form submissions from Netlify page by page.
+    Pages are requested in concurrent windows over the pooled session;
+    a short page marks the end of the listing. Only the current window
+    is held in memory.
+    """
+    first_page = 1
+    with ThreadPoolExecutor(max_workers=NETLIFY_PAGE_CONCURRENCY) as pool:
+        while True:
+            pages = range(first_page, first_page + NETLIFY_PAGE_CONCURRENCY)
+            for batch in pool.map(lambda page: _get_submissions_page(form_id, token, page), pages):
+                yield from batch
+                if len(batch) < NETLIFY_PER_PAGE:
+                    return
+            first_page += NETLIFY_PAGE_CONCURRENCY
+
+
+def get_submissions(form_id: str, token: str) -> List[Dict[str, any]]:
+    """Fetch all form submissions from Netlify with proper error handling."""
+    return list(iter_submissions(form_id, token))
+
+
+def _write_json_atomic(path: Path, data) -> None:
+    """Write JSON to `path` atomically (temp file + os.replace)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    tmp_path.write_bytes(_json_dumps(data))
+    os.replace(tmp_path, path)
+
+
+def get_form_id(netlify_config: NetlifyConfig, use_cache: bool = True) -> Optional[str]:
+    """
+    Resolve the Netlify form id for the configured form name.
+    Form ids are cached on disk so later runs skip the /forms call entirely.
+    """
+    cache_path = NETLIFY_CACHE_DIR / 'netlify_form_id.json'
+    form_ids: Dict[str, str] = {}
+    try:
+        with open(cache_path, 'rb') as f:
+            form_ids = _json_loads(f.read())
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Ignoring unreadable form id cache", path=str(cache_path), error=str(e))
+    
+    if use_cache and netlify_config.form_name in form_ids:
+        return form_ids[netlify_config.form_name]
+    
+    forms = get_forms(netlify_config.site_id, netlify_config.access_token)
+    forms_by_name = {f.get('name'): f for f in forms}
+    form = forms_by_name.get(netlify_config.form_name)
+    if not form:
+        return None
+    
+    form_ids.update({name: f.get('id') for name, f in forms_by_name.items() if name})
+    try:
+        _write_json_atomic(cache_path, form_ids)
+    except OSError as e:
+        logger.warning("Could not write form id cache", path=str(cache_path), error=str(e))
+    return form.get('id')
+
+
+def _reduce_submissions(form_id: str, token: str) -> Tuple[Dict[str, Tuple[str, str]], int]:
+    """
+    Reduce submissions to the latest preference per email (max by created_at).
+    Returns ({email: (created_at, raw_frequency)}, invalid_count).
+    """
+    latest: Dict[str, Tuple[str, str]] = {}
+    invalid_emails = 0
+    match_email = _EMAIL_RE.match
+    
+    # Reduce submissions as pages arrive instead of materializing the full history
+    for submission in iter_submissions(form_id, token):
+        data = submission.get('data') or {}
+        email = data.get('email') or data.get('Email') or data.get('correo')
+        if not email:
+            continue
+        
+        # Normalize once; lowercasing also dedups John@x vs john@X
+        email = str(email).strip().lower()
+        if not match_email(email):
+            invalid_emails += 1
+            continue
+        
+        # Keep the latest submission for each email: one dict probe, tuple values
+        submission_time = submission.get('created_at', '')
+        prev = latest.get(email)
+        if prev is None or submission_time > prev[0]:
+            latest[email] = (submission_time, data.get('frequency', '1'))  # default to every hour
+    
+    return latest, invalid_emails
+
+
 def get_subscribers_from_netlify(netlify_config: NetlifyConfig) -> List[Subscriber]:
     """Get subscribers with their preferences from Netlify Forms."""
     try:
-        forms = get_forms(netlify_config.site_id, netlify_config.access_token)
-        form = next((f for f in forms if f.get('name') == netlify_config.form_name), None)
-        if not form:
+        form_id = get_form_id(netlify_config)
+        if not form_id:
             logger.warning("Form not found", form_name=netlify_config.form_name)
             return []
         
-        submissions = get_submissions(form.get('id'), netlify_config.access_token)
-        
-        # Track latest preference for each email
-        email_prefs = {}
-        invalid_emails = 0
-        
-        for submission in submissions:
-            data = submission.get('data') or {}
-            email = data.get('email') or data.get('Email') or data.get('correo')
-            frequency = data.get('frequency', '1')  # default to every hour
-            
-            if email:
-                email = str(email).strip()
-                # Keep the latest submission for each email
-                submission_time = submission.get('created_at', '')
-                if email not in email_prefs or submission_time > email_prefs[email]['time']:
-                    email_prefs[email] = {
-                        'frequency': int(frequency),
-                        'time': submission_time
-                    }
+        try:
+            email_prefs, invalid_emails = _reduce_submissions(form_id, netlify_config.access_token)
+        except Exception as e:
+            # Cached form id may be stale (form recreated): refetch /forms once
+            if getattr(getattr(e, 'response', None), 'status_code', None) != 404:
+                raise
+            form_id = get_form_id(netlify_config, use_cache=False)
+            if not form_id:
+                logger.warning("Form not found", form_name=netlify_config.form_name)
+                return []
+            email_prefs, invalid_emails = _reduce_submissions(form_id, netlify_config.access_token)
         
         # Convert to validated Subscriber objects
         subscribers = []
-        for email, prefs in email_prefs.items():
+        for email, (_, frequency) in email_prefs.items():
             try:
                 subscriber = Subscriber(
                     email=email,
-                    frequency=prefs['frequency']
+                    frequency=int(frequency)
                 )
                 subscribers.append(subscriber)
             except Exception as e:
@@ -453,8 +790,57 @@ def get_subscribers_from_netlify(netlify_config: NetlifyConfig) -> List[Subscrib
         return []
 
 
-def get_subscribers_from_supabase() -> List[Subscriber]:
-    """Get active subscribers from Supabase database."""
+def load_subscribers_cached(netlify_config: NetlifyConfig,
+                            ttl: int = NETLIFY_CACHE_TTL_SECONDS) -> List[Subscriber]:
+    """
+    Get Netlify subscribers through an on-disk cache with TTL.
+    On a fresh cache hit no HTTP request is made; otherwise the list is
+    refetched and the cache file is rewritten atomically.
+    """
+    cache_path = NETLIFY_CACHE_DIR / f"netlify_{netlify_config.form_name}.json"
+    
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = _json_loads(f.read())
+        if time.time() - cached['fetched_at'] < ttl:
+            subscribers = [
+                Subscriber(email=entry['email'], frequency=entry['frequency'])
+                for entry in cached['subscribers']
+            ]
+            logger.info("Subscribers loaded from cache",
+                       count=len(subscribers),
+                       form_name=netlify_config.form_name)
+            return subscribers
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Ignoring unreadable subscriber cache", path=str(cache_path), error=str(e))
+    
+    subscribers = get_subscribers_from_netlify(netlify_config)
+    if not subscribers:
+        # Don't cache failures or empty listings
+        return subscribers
+    
+    try:
+        _write_json_atomic(cache_path, {
+            'fetched_at': time.time(),
+            'subscribers': [
+                {'email': sub.email, 'frequency': int(sub.frequency)}
+                for sub in subscribers
+            ]
+        })
+    except OSError as e:
+        logger.warning("Could not write subscriber cache", path=str(cache_path), error=str(e))
+    
+    return subscribers
+
+
+def get_subscribers_from_supabase(frequencies: Optional[List[int]] = None) -> List[Subscriber]:
+    """
+    Get active subscribers from Supabase database.
+    frequencies: planes (frequency_hours) a traer; el filtro se hace en Postgres,
+    salvo cuando envía el plan gratuito (ver abajo)
+    """
     if get_db is None:
         logger.error("Supabase database module not available")
         return []
@@ -462,8 +848,15 @@ def get_subscribers_from_supabase() -> List[Subscriber]:
     try:
         db = get_db()
         
-        # Get all active subscribers with their plan details
-        subscribers_data = db.get_all_active_subscribers()
+        # Los frequency_hours desconocidos se tratan como plan gratuito: si el gratuito
+        # envía ahora, Postgres no puede filtrarlos por valor y se filtra aquí tras mapear
+        eligible = None if frequencies is None else frozenset(frequencies)
+        push_down = eligible is not None and FrequencyEnum.FREE_WEEKLY_3 not in eligible
+        
+        # Active subscribers with their plan details, streamed page by page
+        subscribers_data = db.iter_active_subscribers(
+            frequency_hours=sorted(eligible) if push_down else None
+        )
         
         subscribers = []
         invalid_count = 0
@@ -472,24 +865,16 @@ def get_subscribers_from_supabase() -> List[Subscriber]:
             try:
                 # Map frequency hours to FrequencyEnum (NEW 2025 MODEL - Plan ID = Emails por día)
                 frequency_hours = sub_data['frequency_hours']
-                if frequency_hours == 56:  # Plan 0 - Gratuito (3/semana L-M-V)
-                    frequency = FrequencyEnum.FREE_WEEKLY_3
-                elif frequency_hours == 24:  # Plan 1 - Premium 1/día
-                    frequency = FrequencyEnum.DAILY
-                elif frequency_hours == 12:  # Plan 2 - Premium 2/día
-                    frequency = FrequencyEnum.TWICE_DAILY
-                elif frequency_hours == 8:  # Plan 3 - Premium 3/día
-                    frequency = FrequencyEnum.THREE_DAILY
-                elif frequency_hours == 6:  # Plan 4 - Premium 4/día
-                    frequency = FrequencyEnum.EVERY_6_HOURS
-                elif frequency_hours == 1:  # Plan 13 - Power User (13/día manual/VIP)
-                    frequency = FrequencyEnum.HOURLY
-                else:
+                frequency = _FREQ_BY_PLAN_HOURS.get(frequency_hours)
+                if frequency is None:
                     logger.warning("Unknown frequency, defaulting to free plan", 
                                   email=sub_data['email'], 
                                   frequency_hours=frequency_hours)
                     frequency = FrequencyEnum.FREE_WEEKLY_3  # Default to free plan
                 
+                if eligible is not None and frequency not in eligible:
+                    continue
+                
                 subscriber = Subscriber(
                     email=sub_data['email'],
                     frequency=frequency,
@@ -516,58 +901,87 @@ def get_subscribers_from_supabase() -> List[Subscriber]:
         return []
 
 
+# Saludos e introducciones por momento del día: (mañana, tarde, noche)
+_GREETINGS = (
+    ("¡Buenos días!", "Arrancando el día", "Para empezar bien"),
+    ("Mitad del día", "Un momento para reflexionar", "Pausa para inspirarte"),
+    ("Cerrando el día", "Para la tarde", "Reflexión nocturna"),
+)
+# Diario - más personal
+_INTROS_DAILY = (
+    ("Que tengas un día increíble.", "Espero que sea un gran día para ti.", "Comenzamos con energía."),
+    ("Espero que el día vaya bien.", "Un momento de reflexión:", "Para acompañar tu tarde:"),
+    ("Para cerrar el día con buena energía.", "Espero que haya sido un buen día.", "Al final del día:"),
+)
+# Frecuente - más breve
+_INTROS_FREQUENT = (
+    ("Un impulso matutino:", "Para arrancar:", "Energía para la mañana:"),
+    ("Para la tarde:", "Mantén el impulso:", "Continuamos:"),
+    ("Para la noche:", "Cerrando bien:", "Última reflexión:"),
+)
+
+
+@functools.lru_cache(maxsize=256)
 def get_contextual_greeting(hour_peru: int, frequency: FrequencyEnum) -> Tuple[str, str]:
     """
     Retorna (saludo, introducción) contextual según hora y frecuencia.
     hour_peru: hora en Perú (0-23)
     frequency: frecuencia del usuario
     """
-    
-    # Saludos por momento del día
-    if 5 <= hour_peru < 12:  # Mañana
-        greetings = ["¡Buenos días!", "Arrancando el día", "Para empezar bien"]
-        if frequency == FrequencyEnum.DAILY:  # Diario - más personal
-            intros = ["Que tengas un día increíble.", "Espero que sea un gran día para ti.", "Comenzamos con energía."]
-        else:  # Frecuente - más breve
-            intros = ["Un impulso matutino:", "Para arrancar:", "Energía para la mañana:"]
-    elif 12 <= hour_peru < 18:  # Tarde
-        greetings = ["Mitad del día", "Un momento para reflexionar", "Pausa para inspirarte"]
-        if frequency == FrequencyEnum.DAILY:
-            intros = ["Espero que el día vaya bien.", "Un momento de reflexión:", "Para acompañar tu tarde:"]
-        else:
-            intros = ["Para la tarde:", "Mantén el impulso:", "Continuamos:"]
-    else:  # Noche (18-23)
-        greetings = ["Cerrando el día", "Para la tarde", "Reflexión nocturna"]
-        if frequency == FrequencyEnum.DAILY:
-            intros = ["Para cerrar el día con buena energía.", "Espero que haya sido un buen día.", "Al final del día:"]
-        else:
-            intros = ["Para la noche:", "Cerrando bien:", "Última reflexión:"]
+    # Mañana (5-11), tarde (12-17), noche (18-4)
+    bucket = 0 if 5 <= hour_peru < 12 else 1 if 12 <= hour_peru < 18 else 2
+    greetings = _GREETINGS[bucket]
+    intros = (_INTROS_DAILY if frequency == FrequencyEnum.DAILY else _INTROS_FREQUENT)[bucket]
     
     # Selección determinística basada en hora
-    greeting_idx = hour_peru % len(greetings)
-    intro_idx = (hour_peru + 1) % len(intros)
-    
-    return greetings[greeting_idx], intros[intro_idx]
+    return greetings[hour_peru % len(greetings)], intros[(hour_peru + 1) % len(intros)]
 
 
-def generate_unique_timestamp(recipient_email: str, phrase_id: str) -> int:
-    """Generate ultra-unique timestamp to prevent email grouping."""
-    base_time = int(time.time() * 1000000)  # Microsegundos para mayor precisión
-    email_hash = hash(recipient_email) % 100000
-    random_factor = secrets.randbelow(999999)  # Cryptographically secure random
-    phrase_hash = hash(phrase_id) % 10000
-    return base_time + email_hash + random_factor + phrase_hash
+# Contador del proceso: desempata correos generados en el mismo nanosegundo
+_UNIQUE_COUNTER = itertools.count()
 
 
-def build_email_content(subscriber: Subscriber, phrase: Phrase) -> EmailContent:
-    """Build complete email content for a subscriber."""
-    # Obtener hora actual en Perú (UTC-5)
-    from datetime import timedelta
-    peru_tz = timezone(timedelta(hours=-5))
-    now_peru = datetime.now(peru_tz)
-    hour_peru = now_peru.hour
+def generate_unique_timestamp() -> int:
+    """
+    Generate ultra-unique timestamp to prevent email grouping.
+    Solo tiene que diferir entre correos (no es un secreto): nanosegundos + contador.
+    """
+    return (time.time_ns() << 8) | (next(_UNIQUE_COUNTER) & 0xff)
+
+
+# Plantillas del correo modernizado: solo se sustituyen frase, autor y email
+_CONTENT_HTML_TEMPLATE = string.Template("""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width,initial-scale=1">
+</head>
+<body>
+<p>$phrase_text</p>
+<p>— $author_name</p>
+<p><a href="https://pseudosapiens.com/dashboard">Mi Dashboard</a> • <a href="https://pseudosapiens.com/unsubscribe?email=$email">Desuscribirse</a></p>
+</body>
+</html>""")
+
+_CONTENT_TEXT_TEMPLATE = string.Template("""$phrase_text
+
+$author_name
+
+---
+Mi Dashboard: https://pseudosapiens.com/dashboard
+Desuscribirse: https://pseudosapiens.com/unsubscribe?email=$email
+""")
+
+
+def build_email_content(subscriber: Subscriber, phrase: Phrase, hour_peru: Optional[int] = None) -> EmailContent:
+    """
+    Build complete email content for a subscriber.
+    hour_peru: hora actual en Perú, calculada una vez por el llamador para todo el batch
+    """
+    if hour_peru is None:
+        hour_peru = datetime.now(PERU_TZ).hour
     
-    unique_timestamp = generate_unique_timestamp(subscriber.email, phrase.id)
+    unique_timestamp = generate_unique_timestamp()
     
     # Generate smart subject using OpenAI or fallback
     try:
@@ -585,30 +999,14 @@ def build_email_content(subscriber: Subscriber, phrase: Phrase) -> EmailContent:
     # Obtener nombre del autor
     author_name = phrase.author  # "Steve Jobs"
     
-    # Build HTML content - Ultra-minimalista (sin diseño visual)
-    html = f"""<!DOCTYPE html>
-<html>
-<head>
-<meta charset="UTF-8">
-<meta name="viewport" content="width=device-width,initial-scale=1">
-</head>
-<body>
-<p>{phrase.text}</p>
-<p>— {author_name}</p>
-<p><a href="https://pseudosapiens.com/dashboard">Mi Dashboard</a> • <a href="https://pseudosapiens.com/unsubscribe?email={subscriber.email}">Desuscribirse</a></p>
-<div style="display:none">{unique_timestamp}</div>
-</body>
-</html>"""
-
-    # Build text content - Ultra-minimalista
-    text = f"""{phrase.text}
-
-{author_name}
-
----
-Mi Dashboard: https://pseudosapiens.com/dashboard
-Desuscribirse: https://pseudosapiens.com/unsubscribe?email={subscriber.email}
-"""
+    # Build HTML/text content - Ultra-minimalista (plantillas compiladas al importar)
+    fields = {
+        'phrase_text': phrase.text,
+        'author_name': author_name,
+        'email': subscriber.email,
+    }
+    html = _CONTENT_HTML_TEMPLATE.substitute(fields)
+    text = _CONTENT_TEXT_TEMPLATE.substitute(fields)
 
     return EmailContent(
         recipient=subscriber,
@@ -624,34 +1022,163 @@ Desuscribirse: https://pseudosapiens.com/unsubscribe?email={subscriber.email}
 # EMAIL SENDING FUNCTIONS (Modernized)
 # =============================================================================
 
+@functools.lru_cache(maxsize=None)
+def _get_resend_session(api_key: str):
+    """
+    Persistent HTTPS session for the Resend API.
+    The SDK opened a new connection per send; this keeps one keep-alive
+    TLS connection per in-flight worker for the whole run.
+    """
+    _lazy('requests')
+    from requests import Session
+    from requests.adapters import HTTPAdapter
+    
+    session = Session()
+    session.headers.update({"Authorization": f"Bearer {api_key}"})
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=RESEND_MAX_IN_FLIGHT))
+    atexit.register(session.close)
+    return session
+
+
+def resend_post(api_key: str, path: str, payload, idempotency_key: Optional[str] = None):
+    """
+    POST a JSON payload to the Resend API and return the decoded response.
+    Raises requests.HTTPError on 4xx/5xx; `e.response` carries status_code
+    and headers (Retry-After) like the SDK errors did.
+    """
+    # Cuerpo serializado con _json_dumps (orjson si está instalado): los payloads
+    # llevan el HTML completo de cada correo y json.dumps es el paso de CPU más caro
+    headers = {"Content-Type": "application/json"}
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+    response = _get_resend_session(api_key).post(
+        f"{RESEND_API}{path}",
+        data=_json_dumps(payload),
+        headers=headers,
+        timeout=30,
+    )
+    response.raise_for_status()
+    return _json_loads(response.content)
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter for provider API calls.
+    Only waits when the bucket is empty, so time already spent inside the
+    previous request counts toward the spacing instead of being slept again.
+    The rate adapts AIMD-style: halved on each 429 (penalize) and raised back
+    towards the configured rate by a tenth on each success (reward).
+    """
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take one token, sleeping only as long as needed for it to refill (thread-safe)."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1:
+                time.sleep((1 - self.tokens) / self.rate)
+                self.last = time.monotonic()
+                self.tokens = 0
+            else:
+                self.tokens -= 1
+
+    def penalize(self, seconds: float) -> None:
+        """
+        Empty the bucket and push the next refill `seconds` into the future.
+        Used on 429 so every worker sharing the bucket backs off together.
+        """
+        with self._lock:
+            self.tokens = 0
+            self.last = max(self.last, time.monotonic() + seconds)
+            # Disminución multiplicativa, con un piso de 1/8 del ritmo configurado
+            self.rate = max(self.max_rate / 8, self.rate / 2)
+
+    def reward(self) -> None:
+        """Additive increase after a successful call, capped at the configured rate."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+@functools.lru_cache(maxsize=None)
+def get_resend_bucket(throttle_seconds: float) -> TokenBucket:
+    """Shared Resend limiter: one request every `throttle_seconds` on average."""
+    burst = float(os.getenv('RESEND_BURST', '1'))
+    return TokenBucket(rate=1 / max(throttle_seconds, 0.001), capacity=burst)
+
+
+def retry_after_seconds(response) -> Optional[float]:
+    """
+    Retry-After (segundos) de una respuesta 429, o None si falta o no es numérico.
+    requests.Response is falsy for 4xx, so compare against None.
+    """
+    if response is None:
+        return None
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def retry_backoff_seconds(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Seconds to wait before retrying a 429: Retry-After if given, else exponential."""
+    if retry_after is not None:
+        return retry_after
+    return min(30, 2 ** attempt)
+
+
 class EmailSendError(Exception):
     """Custom exception for email sending errors."""
-    def __init__(self, message: str, email: str = "", status_code: Optional[int] = None):
+    def __init__(self, message: str, email: str = "", status_code: Optional[int] = None,
+                 detail: str = ""):
         super().__init__(message)
         self.email = email
         self.status_code = status_code
+        self.detail = detail  # mensaje de error devuelto por Resend
+
+    @property
+    def is_permanent_address_failure(self) -> bool:
+        """True solo si el error es permanente y Resend nombra esta dirección en el mensaje."""
+        return (self.status_code in PERMANENT_FAILURE_STATUS_CODES
+                and bool(self.email)
+                and self.email.lower() in self.detail.lower())
+
+
+def resend_error_detail(exc: Exception) -> str:
+    """Mensaje de error del cuerpo de la respuesta de Resend ('' si no hay respuesta)."""
+    response = getattr(exc, 'response', None)
+    if response is None:
+        return ""
+    try:
+        body = _json_loads(response.content)
+        if isinstance(body, dict) and body.get('message'):
+            return str(body['message'])
+    except Exception:
+        pass
+    return getattr(response, 'text', '') or ""
 
 
-def update_user_email_stats(user_email: str) -> None:
-    """Update email statistics for user after successful email send"""
+def update_user_email_stats(user_email: str) -> bool:
+    """
+    Update email statistics for user after successful email send.
+    Returns True only if the update touched a row.
+    """
     if get_db is None:
         logger.warning("Database module not available for stats update")
-        return
+        return False
     
     try:
-        from supabase import create_client, Client
-        import os
-        from datetime import datetime, timezone
-        
-        # Connect directly to Supabase
-        url = os.getenv('SUPABASE_URL')
-        key = os.getenv('SUPABASE_KEY')
-        
-        if not url or not key:
-            logger.warning("Supabase credentials not available for stats update")
-            return
-            
-        supabase = create_client(url, key)
+        # Cliente compartido del proceso (database.get_db) en vez de uno nuevo por correo
+        supabase = get_db().supabase
         now = datetime.now(timezone.utc)
         
         # Get current user stats
@@ -659,7 +1186,7 @@ def update_user_email_stats(user_email: str) -> None:
         
         if not user_result.data:
             logger.warning("User not found for email stats update", email=user_email)
-            return
+            return False
         
         user = user_result.data[0]
         new_count = (user.get('total_emails_sent') or 0) + 1
@@ -676,6 +1203,10 @@ def update_user_email_stats(user_email: str) -> None:
                         email=user_email,
                         total_emails_sent=new_count,
                         timestamp=now.isoformat())
+            return True
+        
+        logger.warning("User email stats update returned no rows", email=user_email)
+        return False
         
     except Exception as e:
         # Don't fail the email send if stats update fails
@@ -685,30 +1216,87 @@ def update_user_email_stats(user_email: str) -> None:
         raise  # Re-raise to be caught by calling function
 
 
-def send_single_email(config: EmailConfig, content: EmailContent) -> None:
-    """Send a single email with proper error handling and retries."""
-    if resend is None:
-        raise EmailSendError("Resend package not installed", content.recipient.email)
-    
-    resend.api_key = config.api_key
-    slot = str(current_hour_slot())
-    
-    # Create idempotency key
-    idem = hashlib.sha256(
-        (content.subject + "|" + slot + "|" + content.recipient.email).encode('utf-8')
-    ).hexdigest()
+# Destinatarios enviados pendientes de sumar a users.total_emails_sent.
+# Se vacía en lotes con una sola RPC (database/email_stats_batch.sql).
+EMAIL_STATS_BATCH_SIZE = 500
+_email_stats_queue: "queue.Queue[str]" = queue.Queue()
+
+
+def record_email_sent(user_email: str) -> None:
+    """Encola el envío para la actualización de estadísticas en lote (no toca la BD)."""
+    _email_stats_queue.put(user_email)
+
+
+def flush_email_stats() -> int:
+    """
+    Drain queued sends into increment_email_stats RPC calls of up to
+    EMAIL_STATS_BATCH_SIZE emails. Falls back to per-user updates if the
+    RPC is not deployed. Returns the number of users updated.
+    """
+    emails = []
+    while True:
+        try:
+            emails.append(_email_stats_queue.get_nowait())
+        except queue.Empty:
+            break
+    if not emails:
+        return 0
+    if get_db is None:
+        logger.warning("Database module not available for stats update", pending=len(emails))
+        return 0
+
+    sent_at = datetime.now(timezone.utc).isoformat()
+    updated = 0
+    for batch in _chunks(emails, EMAIL_STATS_BATCH_SIZE):
+        try:
+            result = get_db().supabase.rpc('increment_email_stats', {
+                'p_emails': batch,
+                'p_sent_at': sent_at,
+            }).execute()
+            updated += result.data if isinstance(result.data, int) else 0
+        except Exception as e:
+            logger.warning("Batched email stats update failed, falling back to per-user updates",
+                           batch_size=len(batch),
+                           error=str(e))
+            # Solo cuentan las actualizaciones que devolvieron fila; el resto ya quedó en el log
+            for email in batch:
+                try:
+                    updated += update_user_email_stats(email)
+                except Exception:
+                    pass  # update_user_email_stats ya registró el error
+
+    logger.info("User email stats updated", emails=len(emails), users_updated=updated)
+    return updated
+
+
+# Último recurso si el proceso termina sin pasar por send_email_batch
+atexit.register(flush_email_stats)
+
+
+# FIXED: Consistent sender for better reputation (2025 best practice)
+# Dynamic senders damage domain reputation
+CONSISTENT_SENDER = "Pseudosapiens <reflexiones@pseudosapiens.com>"
+
+
+def build_resend_payload(content: EmailContent, idem_prefix=None) -> Dict:
+    """
+    Payload de Resend para un correo (item de /emails o de /emails/batch).
+    idem_prefix: idempotency_prefix(subject, slot) (send_email_batch lo comparte
+    entre los correos con el mismo asunto); se calcula si no se pasa.
+    """
+    if idem_prefix is None:
+        idem_prefix = idempotency_prefix(content.subject, str(current_hour_slot()))
     
-    # FIXED: Consistent sender for better reputation (2025 best practice)
-    # Dynamic senders damage domain reputation
-    consistent_sender = "Pseudosapiens <reflexiones@pseudosapiens.com>"
+    # Create idempotency key: mismo esquema que el resto de envíos
+    idem = idempotency_key(idem_prefix, content.recipient.email)
     
-    email_data = {
-        "from": consistent_sender,  # Sender consistente para mejor reputación
+    return {
+        "from": CONSISTENT_SENDER,  # Sender consistente para mejor reputación
         "to": [content.recipient.email],
         "subject": content.subject,
         "html": content.html,
         "text": content.text,
-        "reply_to": "reflexiones@pseudosapiens.com",
+        "reply_to": REPLY_TO_ADDRESS,
         "headers": {
             "Idempotency-Key": idem,
             "Message-ID": f"<{idem}@pseudosapiens.com>",
@@ -725,35 +1313,37 @@ def send_single_email(config: EmailConfig, content: EmailContent) -> None:
             "X-Priority": "3",
 
             # Headers para BIMI - Branding y Logo (Sep 2025)
-            "X-Mailer": "Pseudosapiens Email System v2.0",
-            "Organization": "Pseudosapiens",
-            "X-Brand-Logo": "https://pseudosapiens.com/favicon.svg",
-            "X-Original-From": "Pseudosapiens <reflexiones@pseudosapiens.com>",
-            "X-Company": "Pseudosapiens"
+            **BRANDING_HEADERS,
         }
     }
+
+
+def send_single_email(config: EmailConfig, content: EmailContent, idem_prefix=None) -> None:
+    """
+    Send a single email with proper error handling and retries.
+    send_email_batch usa /emails/batch y solo recurre a esta función para
+    aislar al destinatario cuando Resend rechaza un lote entero.
+    """
+    email_data = build_resend_payload(content, idem_prefix)
+    idem = email_data["headers"]["Idempotency-Key"]
     
     attempts = 0
     while attempts <= config.max_retries:
         try:
-            resend.Emails.send(email_data)
+            bucket = get_resend_bucket(config.throttle_seconds)
+            bucket.acquire()
+            resend_post(config.api_key, "/emails", email_data, idempotency_key=idem)
+            bucket.reward()
             
-            # Update user email statistics in Supabase
-            try:
-                update_user_email_stats(content.recipient.email)
-            except Exception as stats_error:
-                logger.warning("Failed to update email stats, but email was sent", 
-                             recipient=content.recipient.email,
-                             error=str(stats_error))
+            # Update user email statistics in Supabase (en lote, al final del batch)
+            record_email_sent(content.recipient.email)
             
             logger.info("Email sent successfully", 
                        recipient=content.recipient.email,
                        subject=content.subject,
                        phrase_id=content.phrase.id,
                        author=content.phrase.author,
-                       sender=consistent_sender)
-            # Respect rate limits
-            time.sleep(config.throttle_seconds)
+                       sender=CONSISTENT_SENDER)
             return
             
         except Exception as e:
@@ -768,23 +1358,13 @@ def send_single_email(config: EmailConfig, content: EmailContent) -> None:
                         429
                     )
                 
-                # Get retry-after header
-                response = getattr(e, 'response', None)
-                retry_after = None
-                if response and hasattr(response, 'headers'):
-                    retry_after = response.headers.get('Retry-After') or response.headers.get('retry-after')
-                    if retry_after:
-                        try:
-                            retry_after = int(retry_after)
-                        except ValueError:
-                            retry_after = None
-                
-                sleep_time = retry_after if retry_after else 1.5
+                sleep_time = retry_backoff_seconds(attempts, retry_after_seconds(getattr(e, 'response', None)))
                 logger.warning("Rate limited, retrying", 
                               recipient=content.recipient.email,
                               attempt=attempts,
                               sleep_time=sleep_time)
-                time.sleep(sleep_time)
+                # Next acquire() waits it out (shared with any other sender)
+                get_resend_bucket(config.throttle_seconds).penalize(sleep_time)
                 continue
             
             # Other errors
@@ -792,7 +1372,8 @@ def send_single_email(config: EmailConfig, content: EmailContent) -> None:
                         recipient=content.recipient.email,
                         error=str(e),
                         status_code=status_code)
-            raise EmailSendError(f"Email send failed: {str(e)}", content.recipient.email, status_code)
+            raise EmailSendError(f"Email send failed: {str(e)}", content.recipient.email, status_code,
+                                 detail=resend_error_detail(e))
 
 
 def send_email_batch(config: EmailConfig, contents: List[EmailContent]) -> Tuple[int, int]:
@@ -800,23 +1381,89 @@ def send_email_batch(config: EmailConfig, contents: List[EmailContent]) -> Tuple
     success_count = 0
     error_count = 0
     
-    logger.info("Starting email batch", total_emails=len(contents))
+    suppressed_count = len(contents)
+    contents = [c for c in contents if not is_suppressed(c.recipient.email)]
+    suppressed_count -= len(contents)
     
+    logger.info("Starting email batch",
+               total_emails=len(contents),
+               suppressed=suppressed_count)
+    
+    # Slot una vez por batch y un prefijo de idempotencia por asunto distinto
+    slot = str(current_hour_slot())
+    idem_prefixes: Dict[str, object] = {}
     for content in contents:
-        try:
-            send_single_email(config, content)
-            success_count += 1
-        except EmailSendError as e:
-            logger.error("Failed to send email", 
-                        recipient=e.email,
-                        error=str(e),
-                        status_code=e.status_code)
-            error_count += 1
-        except Exception as e:
-            logger.error("Unexpected error sending email",
-                        recipient=content.recipient.email,
-                        error=str(e))
-            error_count += 1
+        if content.subject not in idem_prefixes:
+            idem_prefixes[content.subject] = idempotency_prefix(content.subject, slot)
+    
+    # Lotes de hasta 100 correos por llamada a /emails/batch (cuerpos distintos por item);
+    # varios lotes en vuelo sobre la sesión compartida, el token bucket marca el ritmo
+    bucket = get_resend_bucket(config.throttle_seconds)
+    batches = list(_chunks(contents, RESEND_BATCH_SIZE))
+    with ThreadPoolExecutor(max_workers=RESEND_MAX_IN_FLIGHT) as pool:
+        futures = {
+            pool.submit(
+                _send_resend_batch, config.api_key, bucket,
+                [build_resend_payload(c, idem_prefixes[c.subject]) for c in batch],
+                config.max_retries,
+            ): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                future.result()
+                for content in batch:
+                    # Update user email statistics in Supabase (en lote, al final del batch)
+                    record_email_sent(content.recipient.email)
+                success_count += len(batch)
+                logger.info("Email batch sent successfully",
+                           recipients=len(batch),
+                           sender=CONSISTENT_SENDER)
+            except Exception as e:
+                status_code = getattr(getattr(e, 'response', None), 'status_code', None)
+                if status_code not in PERMANENT_FAILURE_STATUS_CODES:
+                    logger.error("Failed to send email batch",
+                                recipients=len(batch),
+                                error=str(e),
+                                status_code=status_code)
+                    error_count += len(batch)
+                    continue
+                # Resend valida el lote completo: reenviar uno a uno para encontrar
+                # (y suprimir) solo las direcciones que fallan de forma permanente
+                logger.warning("Email batch rejected, retrying individually",
+                              recipients=len(batch),
+                              status_code=status_code)
+                failures: List[EmailSendError] = []
+                for content in batch:
+                    try:
+                        send_single_email(config, content, idem_prefixes[content.subject])
+                        success_count += 1
+                    except EmailSendError as e:
+                        logger.error("Failed to send email", 
+                                    recipient=e.email,
+                                    error=str(e),
+                                    status_code=e.status_code,
+                                    detail=e.detail)
+                        failures.append(e)
+                        error_count += 1
+                
+                # Si todo el lote falla igual (mismo estado y mensaje, quitando la dirección)
+                # el problema es el payload, no los destinatarios: no se suprime a nadie
+                same_failure = len(batch) > 1 and len(failures) == len(batch) and len({
+                    (f.status_code, f.detail.lower().replace(f.email.lower(), '')) for f in failures
+                }) == 1
+                if same_failure:
+                    logger.warning("Every email in the batch failed the same way, not suppressing",
+                                  recipients=len(batch),
+                                  status_code=failures[0].status_code,
+                                  detail=failures[0].detail)
+                    continue
+                for failure in failures:
+                    if failure.is_permanent_address_failure:
+                        suppress_email(failure.email, reason=f"status {failure.status_code}: {failure.detail}")
+    
+    flush_email_stats()
     
     logger.info("Email batch completed", 
                success_count=success_count,
@@ -830,6 +1477,45 @@ def send_email_batch(config: EmailConfig, contents: List[EmailContent]) -> Tuple
 # MAIN FUNCTION (Modernized)
 # =============================================================================
 
+def _build_subscriber_content(subscriber: Subscriber, hour_peru: int,
+                              get_random_phrase_for_user, get_random_phrase) -> Optional[EmailContent]:
+    """
+    Frase individual + contenido para un suscriptor; None si no se pudo construir.
+    Se ejecuta en un hilo del pool de main_modernized, por eso no deja escapar excepciones.
+    """
+    try:
+        # Get individual phrase for this user (anti-repetition system)
+        if subscriber.user_id:
+            phrase_data = get_random_phrase_for_user(subscriber.user_id)
+        else:
+            phrase_data = get_random_phrase()
+
+        if not phrase_data:
+            logger.error("No phrase available",
+                        subscriber_email=subscriber.email,
+                        user_id=subscriber.user_id)
+            return None
+
+        phrase = Phrase(
+            id=phrase_data['id'],
+            text=phrase_data['text'],
+            author=phrase_data['author']
+        )
+        content = build_email_content(subscriber, phrase, hour_peru)
+        logger.debug("Individual phrase selected",
+                    user_id=subscriber.user_id,
+                    email=subscriber.email[:20] + "...",
+                    phrase_id=phrase.id)
+        return content
+
+    except Exception as e:
+        logger.error("Failed to build email content",
+                    subscriber_email=subscriber.email,
+                    user_id=subscriber.user_id,
+                    error=str(e))
+        return None
+
+
 def main_modernized(argv: List[str]) -> int:
     """Modernized main function with proper error handling and type safety."""
     dry_run = "--dry-run" in argv
@@ -839,12 +1525,21 @@ def main_modernized(argv: List[str]) -> int:
                 dry_run=dry_run, 
                 test_mode=test_mode)
 
+    # Read the clock once for the whole run
+    now = time.time()
+
     # Check if we're in sending hours (5:00 AM - 11:59 PM Peru time)
-    if not dry_run and not is_sending_hours():
+    if not dry_run and not is_sending_hours(now):
         logger.info("Outside sending hours - no emails will be sent",
                    sending_hours="5:00 AM - 11:59 PM Peru time")
         return 0
 
+    # Planes con envío en esta hora; si no hay ninguno no se toca Supabase ni configs
+    eligible_frequencies = sorted(frequencies_sending_now(PLAN_FREQUENCIES))
+    if not dry_run and not eligible_frequencies:
+        logger.info("No plan sends at this hour - no emails will be sent")
+        return 0
+
     try:
         # Load configurations - only load email config if not dry-run
         if not dry_run:
@@ -858,21 +1553,33 @@ def main_modernized(argv: List[str]) -> int:
             from database_phrases import get_random_phrase_for_user, get_random_phrase
         except ImportError as e:
             logger.error("Database module not available", error=str(e))
-            return
+            return 1
         except Exception as e:
             logger.error("Error importing phrase functions", error=str(e))
-            return
+            return 1
         
         # Get current hour slot for logging
-        slot = current_hour_slot()
+        slot = current_hour_slot(now)
+        # Hora de Perú para asuntos/saludos: la misma para todo el batch
+        hour_peru = datetime.fromtimestamp(now, PERU_TZ).hour
+
+        # Skip hour slots that already went out (e.g. CI retried the job)
+        slot_key = slot_send_key("modernized", str(slot))
+        if not dry_run and not test_mode:
+            rotate_sent_markers()
+            if slot_already_sent(slot_key):
+                logger.info("Hour slot already sent - skipping", hour_slot=slot)
+                return 0
 
         # Get subscribers from Supabase
         all_subscribers: List[Subscriber] = []
         
         if test_mode:
             # Test mode: use only test emails
-            test_emails = os.getenv('TEST_EMAILS', '').split(',')
-            test_emails = [email.strip() for email in test_emails if email.strip()]
+            # Strip once and dedup in a single order-preserving pass
+            test_emails = list(dict.fromkeys(
+                email for email in map(str.strip, os.getenv('TEST_EMAILS', '').split(',')) if email
+            ))
             if test_emails:
                 for email in test_emails:
                     try:
@@ -888,18 +1595,33 @@ def main_modernized(argv: List[str]) -> int:
                 
         else:
             # Production mode: get subscribers from Supabase
-            all_subscribers = get_subscribers_from_supabase()
+            # Solo los planes con envío en esta hora: Postgres descarta el resto
+            all_subscribers = get_subscribers_from_supabase(eligible_frequencies)
 
         # Filter subscribers based on their frequency preference and optimal hours
-        active_subscribers = []
-        for subscriber in all_subscribers:
-            if should_send_at_current_hour(int(subscriber.frequency.value)):
-                active_subscribers.append(subscriber)
+        # (decisión ya tomada una vez por plan al inicio; aquí solo un lookup por suscriptor)
+        if test_mode:
+            sending_frequencies = frozenset(eligible_frequencies)
+            active_subscribers = [
+                sub for sub in all_subscribers if sub.frequency in sending_frequencies
+            ]
+        else:
+            # Supabase ya devolvió solo los planes de esta hora (filtro fusionado con la
+            # carga): sin segunda pasada ni copia de la lista
+            active_subscribers = all_subscribers
 
         logger.info("Subscriber filtering complete", 
                    total_subscribers=len(all_subscribers),
                    active_this_hour=len(active_subscribers))
 
+        # Frase individual + contenido por suscriptor (mismo helper para preview y envío)
+        build = functools.partial(
+            _build_subscriber_content,
+            hour_peru=hour_peru,
+            get_random_phrase_for_user=get_random_phrase_for_user,
+            get_random_phrase=get_random_phrase,
+        )
+
         if dry_run:
             logger.info("DRY RUN - Email content preview", 
                        hour_slot=slot, 
@@ -907,31 +1629,16 @@ def main_modernized(argv: List[str]) -> int:
                        active_subscribers=len(active_subscribers))
             
             # Show preview of first few subscribers with individual phrases
+            # (_build_subscriber_content ya registra el error si no hay frase o contenido)
             for i, subscriber in enumerate(active_subscribers[:3]):
-                try:
-                    # Get individual phrase for this user
-                    if subscriber.user_id:
-                        phrase_data = get_random_phrase_for_user(subscriber.user_id)
-                    else:
-                        phrase_data = get_random_phrase()
-                    
-                    if phrase_data:
-                        phrase = Phrase(
-                            id=phrase_data['id'],
-                            text=phrase_data['text'],
-                            author=phrase_data['author']
-                        )
-                        content = build_email_content(subscriber, phrase)
-                        logger.info(f"Preview {i+1}", 
-                                   recipient=subscriber.email,
-                                   frequency=subscriber.frequency.name,
-                                   subject=content.subject,
-                                   phrase_id=phrase.id,
-                                   phrase_preview=phrase.text[:50] + "...")
-                    else:
-                        logger.error(f"No phrase for preview {i+1}", recipient=subscriber.email)
-                except Exception as e:
-                    logger.error(f"Error in preview {i+1}", recipient=subscriber.email, error=str(e))
+                content = build(subscriber)
+                if content is not None:
+                    logger.info(f"Preview {i+1}", 
+                               recipient=subscriber.email,
+                               frequency=subscriber.frequency.name,
+                               subject=content.subject,
+                               phrase_id=content.phrase.id,
+                               phrase_preview=content.phrase.text[:50] + "...")
             return 0
 
         if not active_subscribers:
@@ -941,37 +1648,12 @@ def main_modernized(argv: List[str]) -> int:
             return 0
 
         # Build email content for all active subscribers - individual phrases per user
-        email_contents = []
-        for subscriber in active_subscribers:
-            try:
-                # Get individual phrase for this user (anti-repetition system)
-                if subscriber.user_id:
-                    phrase_data = get_random_phrase_for_user(subscriber.user_id)
-                else:
-                    phrase_data = get_random_phrase()
-                
-                if phrase_data:
-                    phrase = Phrase(
-                        id=phrase_data['id'],
-                        text=phrase_data['text'],
-                        author=phrase_data['author']
-                    )
-                    content = build_email_content(subscriber, phrase)
-                    email_contents.append(content)
-                    logger.info("Individual phrase selected", 
-                               user_id=subscriber.user_id,
-                               email=subscriber.email[:20] + "...",
-                               phrase_id=phrase.id)
-                else:
-                    logger.error("No phrase available", 
-                                subscriber_email=subscriber.email,
-                                user_id=subscriber.user_id)
-                    
-            except Exception as e:
-                logger.error("Failed to build email content", 
-                            subscriber_email=subscriber.email,
-                            user_id=subscriber.user_id,
-                            error=str(e))
+        # Cada suscriptor espera a Supabase y OpenAI, así que se preparan en paralelo;
+        # map conserva el orden original de los suscriptores
+        with ThreadPoolExecutor(max_workers=CONTENT_BUILD_WORKERS) as pool:
+            email_contents = [
+                content for content in pool.map(build, active_subscribers) if content is not None
+            ]
 
         logger.info("Email content generated", 
                    emails_to_send=len(email_contents))
@@ -982,6 +1664,11 @@ def main_modernized(argv: List[str]) -> int:
         else:
             success_count, error_count = 0, 0
 
+        # Solo si no falló ningún correo: con fallos, un reintento en la misma hora
+        # debe poder volver a enviar a los destinatarios pendientes
+        if success_count and error_count == 0 and not test_mode:
+            mark_slot_sent(slot_key)
+
         if error_count == 0:
             logger.info("All emails sent successfully", 
                        success_count=success_count,
@@ -998,38 +1685,18 @@ def main_modernized(argv: List[str]) -> int:
         return 1
 
 
-def build_email_html(phrase_id: str, phrase_text: str, recipient_email: str = "", frequency: int = 1) -> str:
-    """
-    Email ultra personal - como un mensaje de texto de un amigo.
-    Sin footers corporativos ni elementos que parezcan newsletter.
-    """
-    
-    # Obtener hora actual en Perú (UTC-5)
-    import hashlib
-    from datetime import datetime, timezone, timedelta
-    from urllib.parse import quote
-    
-    peru_tz = timezone(timedelta(hours=-5))
-    now_peru = datetime.now(peru_tz)
-    hour_peru = now_peru.hour
-    
-    # Usar la frecuencia pasada como parámetro
-    
-    greeting, intro = get_contextual_greeting(hour_peru, frequency)
-    
-    # Timestamp ultra-único por email (múltiples factores de unicidad)
-    import random
-    import time
-    base_time = int(time.time() * 1000000)  # Microsegundos para mayor precisión
-    email_hash = hash(recipient_email) % 100000
-    random_factor = random.randint(100000, 999999)  # Factor aleatorio grande
-    phrase_hash = hash(phrase_id) % 10000
-    unique_timestamp = base_time + email_hash + random_factor + phrase_hash
-    
-    # Ya no necesitamos pasar datos por URL - entrada manual más segura
-    
-    # HTML mínimo que parece mensaje personal
-    html = f"""<!DOCTYPE html>
+def _minify_html(markup: str) -> str:
+    """Minificador simple para plantillas sin <pre>/<style>: quita comentarios y espacios entre tags."""
+    markup = re.sub(r'<!--.*?-->', '', markup, flags=re.S)
+    markup = re.sub(r'>\s+<', '><', markup)
+    markup = re.sub(r'>\s*\n\s*', '>', markup)
+    markup = re.sub(r'\s*\n\s*</', '</', markup)
+    markup = re.sub(r'\s*\n\s*', ' ', markup)
+    return markup.strip()
+
+
+# Plantilla HTML legible; se minifica y compila una sola vez al importar el módulo
+_RAW_EMAIL_HTML = """<!DOCTYPE html>
 <html>
 <head>
 <meta charset="UTF-8">
@@ -1038,15 +1705,15 @@ def build_email_html(phrase_id: str, phrase_text: str, recipient_email: str = ""
 <body style="margin:0;padding:20px;font-family:system-ui,sans-serif;line-height:1.5;color:#333">
 
 <p style="margin:0 0 20px;font-size:16px">
-{greeting}
+$greeting
 </p>
 
 <p style="margin:20px 0;font-size:16px;color:#555">
-{intro}
+$intro
 </p>
 
 <p style="margin:20px 0;font-size:17px;font-style:italic;color:#444;padding:15px;background:#f8f9fa;border-left:3px solid #ddd">
-{phrase_text}
+$phrase_text
 </p>
 
 <p style="margin:20px 0 5px;font-size:14px;color:#666">
@@ -1059,46 +1726,50 @@ Pseudosapiens
 <a href="https://pseudosapiens.com/unsubscribe" style="color:#999">Desuscribirse</a>
 </p>
 
-<!-- Timestamp invisible único para evitar agrupación en Gmail -->
-<div style="display:none;font-size:1px;color:transparent">{unique_timestamp}</div>
-
 </body>
 </html>"""
-    return html
+_EMAIL_HTML_TEMPLATE = string.Template(_minify_html(_RAW_EMAIL_HTML))
 
 
-def build_email_text(phrase_text: str, recipient_email: str = "", frequency: int = 1) -> str:
+def _stable_token(value: str) -> int:
+    """Entero de 32 bits determinístico (BLAKE2b); hash() cambia entre procesos (PYTHONHASHSEED)."""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=4).digest(), 'big')
+
+
+def build_email_html(phrase_id: str, phrase_text: str, recipient_email: str = "", frequency: int = 1,
+                     hour_peru: Optional[int] = None) -> str:
     """
-    Texto plano ultra personal - como un mensaje de WhatsApp.
+    Email ultra personal - como un mensaje de texto de un amigo.
+    Sin footers corporativos ni elementos que parezcan newsletter.
+    hour_peru: hora en Perú calculada una vez por el llamador (se lee el reloj si no se pasa)
     """
-    # Obtener hora actual en Perú (UTC-5)
-    from datetime import datetime, timezone, timedelta
-    from urllib.parse import quote
     
-    peru_tz = timezone(timedelta(hours=-5))
-    now_peru = datetime.now(peru_tz)
-    hour_peru = now_peru.hour
+    # Obtener hora actual en Perú (UTC-5)
+    if hour_peru is None:
+        hour_peru = datetime.now(PERU_TZ).hour
     
     # Usar la frecuencia pasada como parámetro
     
     greeting, intro = get_contextual_greeting(hour_peru, frequency)
     
-    # Timestamp ultra-único por email (múltiples factores de unicidad) 
-    import random
-    import secrets
-    base_time = int(time.time() * 1000000)  # Microsegundos para mayor precisión
-    email_hash = hash(recipient_email) % 100000
-    secure_random = secrets.randbelow(999999)  # Cryptographically secure random
-    phrase_hash = hash(phrase_text[:20]) % 10000  # Usar parte de la frase
-    unique_timestamp = base_time + email_hash + secure_random + phrase_hash
+    # Sin timestamp oculto: el Message-ID por destinatario ya evita que Gmail agrupe
     
     # Ya no necesitamos pasar datos por URL - entrada manual más segura
     
-    return f"""{greeting}
+    # HTML mínimo que parece mensaje personal
+    return _EMAIL_HTML_TEMPLATE.substitute(
+        greeting=greeting,
+        intro=intro,
+        phrase_text=html_escape(phrase_text),
+    )
+
 
-{intro}
+# Plantilla de texto plano compilada una sola vez al importar el módulo
+_EMAIL_TEXT_TEMPLATE = string.Template("""$greeting
 
-{phrase_text}
+$intro
+
+$phrase_text
 
 Un saludo,
 Pseudosapiens
@@ -1107,20 +1778,39 @@ Pseudosapiens
 Mi Dashboard: https://pseudosapiens.com/dashboard
 Desuscribirse: https://pseudosapiens.com/unsubscribe
 
-"""
+""")
+
+
+def build_email_text(phrase_text: str, recipient_email: str = "", frequency: int = 1,
+                     hour_peru: Optional[int] = None) -> str:
+    """
+    Texto plano ultra personal - como un mensaje de WhatsApp.
+    hour_peru: hora en Perú calculada una vez por el llamador (se lee el reloj si no se pasa)
+    """
+    # Obtener hora actual en Perú (UTC-5)
+    if hour_peru is None:
+        hour_peru = datetime.now(PERU_TZ).hour
+    
+    # Usar la frecuencia pasada como parámetro
+    
+    greeting, intro = get_contextual_greeting(hour_peru, frequency)
+    
+    # Ya no necesitamos pasar datos por URL - entrada manual más segura
+    
+    return _EMAIL_TEXT_TEMPLATE.substitute(greeting=greeting, intro=intro, phrase_text=phrase_text)
 
 
-def send_via_resend_with_context(sender: str, recipients_data: List[Dict], subject: str, phrase_id: str, phrase_text: str) -> None:
+def send_via_resend_with_context(sender: str, recipients_data: List[Dict], subject: str, phrase_id: str, phrase_text: str,
+                                 slot: Optional[int] = None) -> None:
     """
-    Envia correos con contexto personalizado por destinatario.
+    Envia correos con contexto personalizado por destinatario, agrupados en lotes
+    de hasta 100 para el endpoint batch de Resend.
     recipients_data: lista de {'email': str, 'frequency': int}
+    slot: hour slot ya calculado por el llamador (se calcula si no se pasa)
     """
     api_key = os.getenv('RESEND_API_KEY')
     if not api_key:
         raise RuntimeError('Falta RESEND_API_KEY')
-    if resend is None:  # pragma: no cover
-        raise RuntimeError('El paquete resend no está instalado.')
-    resend.api_key = api_key
 
     # Config de throttling y reintentos
     try:
@@ -1132,211 +1822,185 @@ def send_via_resend_with_context(sender: str, recipients_data: List[Dict], subje
     except Exception:
         max_retries = 8
 
-    slot = str(current_hour_slot())
+    bucket = get_resend_bucket(throttle_seconds)
+    slot = str(current_hour_slot() if slot is None else slot)
+
+    # Misma hora de Perú para todo el envío: saludo/intro salen de la caché por (hora, frecuencia)
+    hour_peru = datetime.now(PERU_TZ).hour
+    payloads = _render_context_emails(sender, recipients_data, subject, phrase_id, phrase_text,
+                                      idempotency_prefix(subject, slot), hour_peru)
 
+    # Pipeline: cada lote completo se envía mientras se arman los cuerpos del siguiente
+    futures = []
+    with ThreadPoolExecutor(max_workers=RESEND_MAX_IN_FLIGHT) as pool:
+        while True:
+            # El endpoint batch acepta cuerpos distintos por item: 1 llamada HTTP cada 100 correos
+            batch = list(itertools.islice(payloads, RESEND_BATCH_SIZE))
+            if not batch:
+                break
+            futures.append(pool.submit(_send_resend_batch, api_key, bucket, batch, max_retries))
+        for future in futures:
+            future.result()  # propaga el primer error, como antes
+
+
+def _render_context_emails(sender: str, recipients_data: List[Dict], subject: str, phrase_id: str,
+                           phrase_text: str, idem_prefix, hour_peru: int) -> Iterator[Dict]:
+    """
+    Paso de CPU de send_via_resend_with_context: genera el payload completo de cada
+    destinatario (cuerpos personalizados + Idempotency-Key), sin tocar la red.
+    """
     for recipient_data in recipients_data:
         email = recipient_data['email']
+        if is_suppressed(email):
+            continue
         frequency = recipient_data['frequency']
         
         # Generar contenido personalizado para este destinatario
-        html = build_email_html(phrase_id, phrase_text, email, frequency)
-        text = build_email_text(phrase_text, email, frequency)
+        html = build_email_html(phrase_id, phrase_text, email, frequency, hour_peru)
+        text = build_email_text(phrase_text, email, frequency, hour_peru)
         
         # URL limpia para compliance headers
         unsubscribe_url = "https://pseudosapiens.com/unsubscribe"
         
         # Idempotency por destinatario
-        idem = hashlib.sha256((subject + "|" + slot + "|" + email).encode('utf-8')).hexdigest()
-
-        attempts = 0
-        while True:
-            try:
-                email_data = {
-                    "from": sender,
-                    "to": [email],  # Envío individual
-                    "subject": subject,
-                    "html": html,
-                    "reply_to": "reflexiones@pseudosapiens.com",
-                    "headers": {
-                        "Idempotency-Key": idem,
-                        "Message-ID": f"<{idem}@pseudosapiens.com>",
-                        # Headers básicos - sin List-Unsubscribe por ahora
-                        # "List-Unsubscribe": f"<{unsubscribe_url}>",
-                        # "List-Unsubscribe-Post": "List-Unsubscribe=One-Click",
-
-                        # Headers para BIMI - Branding y Logo (Sep 2025)
-                        "X-Mailer": "Pseudosapiens Email System v2.0",
-                        "Organization": "Pseudosapiens",
-                        "X-Brand-Logo": "https://pseudosapiens.com/favicon.svg",
-                        "X-Original-From": "Pseudosapiens <reflexiones@pseudosapiens.com>",
-                        "X-Company": "Pseudosapiens"
-                    }
-                }
-                
-                # Add text version if provided
-                if text:
-                    email_data["text"] = text
-                
-                resend.Emails.send(email_data)
-                # Asegura <= 2 req/seg (0.5s); usamos 0.6s como colchón
-                time.sleep(throttle_seconds)
-                break
-            except Exception as e:
-                # Si es un 429, respetar Retry-After y reintentar
-                status = None
-                retry_after_s = None
-                resp = getattr(e, "response", None)
-                if resp is not None:
-                    status = getattr(resp, "status_code", None)
-                    headers = getattr(resp, "headers", {}) or {}
-                    ra = headers.get("Retry-After") or headers.get("retry-after")
-                    if ra:
-                        try:
-                            retry_after_s = int(ra)
-                        except Exception:
-                            retry_after_s = None
-
-                if status == 429:
-                    attempts += 1
-                    if attempts > max_retries:
-                        raise
-                    time.sleep(retry_after_s if retry_after_s is not None else 1.5)
-                    continue  # volver a intentar
-                # Otros errores: propagar
-                raise
+        idem = idempotency_key(idem_prefix, email)
+
+        email_data = {
+            "from": sender,
+            "to": [email],  # Envío individual
+            "subject": subject,
+            "html": html,
+            "reply_to": REPLY_TO_ADDRESS,
+            "headers": {
+                "Idempotency-Key": idem,
+                "Message-ID": f"<{idem}@pseudosapiens.com>",
+                # Headers básicos - sin List-Unsubscribe por ahora
+                # "List-Unsubscribe": f"<{unsubscribe_url}>",
+                # "List-Unsubscribe-Post": "List-Unsubscribe=One-Click",
+                **BRANDING_HEADERS,
+            }
+        }
+        
+        # Add text version if provided
+        if text:
+            email_data["text"] = text
+        yield email_data
+
+
+def _chunks(items: List, size: int) -> Iterator[List]:
+    """Yield consecutive slices of at most `size` items."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _send_resend_batch(api_key: str, bucket: TokenBucket, batch: List[Dict], max_retries: int) -> None:
+    """POST de un lote a /emails/batch, reintentando 429 con Retry-After sobre el bucket compartido."""
+    # Clave de idempotencia HTTP del batch: derivada de las claves de sus correos,
+    # absorbidas una a una sin armar el string concatenado
+    h = hashlib.blake2b(digest_size=16)
+    for email in batch:
+        h.update(email["headers"]["Idempotency-Key"].encode('ascii'))
+    batch_idem = h.hexdigest()
+    attempts = 0
+    while True:
+        try:
+            # Asegura <= 2 req/seg (0.5s); usamos 0.6s como colchón
+            bucket.acquire()
+            resend_post(api_key, "/emails/batch", batch, idempotency_key=batch_idem)
+            bucket.reward()
+            break
+        except Exception as e:
+            # Si es un 429, respetar Retry-After y reintentar
+            resp = getattr(e, "response", None)
+            if getattr(resp, "status_code", None) == 429:
+                attempts += 1
+                if attempts > max_retries:
+                    raise
+                # Pausa global: el plazo se fija en el bucket compartido, así todos los
+                # workers esperan hasta el mismo instante en vez de reintentar en estampida
+                bucket.penalize(retry_backoff_seconds(attempts, retry_after_seconds(resp)))
+                continue  # volver a intentar
+            # Otros errores: propagar
+            raise
 
 
-def send_via_resend(sender: str, to: List[str], subject: str, html: str, text: str = "") -> None:
+def select_hourly_phrase(slot: int) -> Optional[Tuple[int, Dict]]:
     """
-    Envia correos con Resend cumpliendo el límite de 2 req/seg y reintenta si hay 429.
-    - Envia 1 correo por destinatario para preservar privacidad.
-    - Usa Idempotency-Key por destinatario para evitar duplicados en reintentos.
-    - Respeta header Retry-After cuando Resend devuelve 429 (Too Many Requests).
-    Puedes ajustar el ritmo y reintentos con:
-      RESEND_THROTTLE_SECONDS (float, por defecto 0.6s) y RESEND_MAX_RETRIES (int, por defecto 8).
+    Deterministic phrase for an hour slot, cached on disk for the rest of the hour.
+    Reruns within the same slot (e.g. CI retries) skip the Supabase count + fetch.
+    Returns (index, phrase) or None if no phrase is available.
     """
-    api_key = os.getenv('RESEND_API_KEY')
-    if not api_key:
-        raise RuntimeError('Falta RESEND_API_KEY')
-    if resend is None:  # pragma: no cover
-        raise RuntimeError('El paquete resend no está instalado.')
-    resend.api_key = api_key
-
-    # Config de throttling y reintentos
+    cache_path = CACHE_DIR / f"phrase-{slot}.json"
     try:
-        throttle_seconds = float(os.getenv('RESEND_THROTTLE_SECONDS', '0.6'))
-    except Exception:
-        throttle_seconds = 0.6
+        cached = _json_loads(cache_path.read_bytes())
+        return cached['index'], cached['phrase']
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Ignoring unreadable phrase cache", path=str(cache_path), error=str(e))
+    
+    # Count phrases in Supabase (the full catalogue is not needed to pick one)
+    from database_phrases import get_phrase_count, load_phrase_at
+    phrase_count = get_phrase_count()
+    if not phrase_count:
+        logger.error("No phrases found in Supabase database")
+        return None
+    
+    seed_bytes = hashlib.blake2b(f"{slot}:{phrase_count}".encode('utf-8'), digest_size=8).digest()
+    idx = int.from_bytes(seed_bytes, 'big') % phrase_count
+    phrase = load_phrase_at(idx)
+    if not phrase:
+        logger.error("Could not load selected phrase", index=idx)
+        return None
+    
     try:
-        max_retries = int(os.getenv('RESEND_MAX_RETRIES', '8'))
-    except Exception:
-        max_retries = 8
-
-    slot = str(current_hour_slot())
-
-    for recipient in to:
-        # Idempotency por destinatario
-        idem = hashlib.sha256((subject + "|" + slot + "|" + recipient).encode('utf-8')).hexdigest()
-
-        attempts = 0
-        while True:
-            try:
-                email_data = {
-                    "from": sender,
-                    "to": [recipient],  # Envío individual
-                    "subject": subject,
-                    "html": html,
-                    "reply_to": "reflexiones@pseudosapiens.com",
-                    "headers": {
-                        "Idempotency-Key": idem,
-                        "Message-ID": f"<{idem}@pseudosapiens.com>",
-
-                        # Headers para BIMI - Branding y Logo (Sep 2025)
-                        "X-Mailer": "Pseudosapiens Email System v2.0",
-                        "Organization": "Pseudosapiens",
-                        "X-Brand-Logo": "https://pseudosapiens.com/favicon.svg",
-                        "X-Original-From": "Pseudosapiens <reflexiones@pseudosapiens.com>",
-                        "X-Company": "Pseudosapiens"
-                    }
-                }
-                
-                # Add text version if provided
-                if text:
-                    email_data["text"] = text
-                
-                resend.Emails.send(email_data)
-                # Asegura <= 2 req/seg (0.5s); usamos 0.6s como colchón
-                time.sleep(throttle_seconds)
-                break
-            except Exception as e:
-                # Si es un 429, respetar Retry-After y reintentar
-                status = None
-                retry_after_s = None
-                resp = getattr(e, "response", None)
-                if resp is not None:
-                    status = getattr(resp, "status_code", None)
-                    headers = getattr(resp, "headers", {}) or {}
-                    ra = headers.get("Retry-After") or headers.get("retry-after")
-                    if ra:
-                        try:
-                            retry_after_s = int(ra)
-                        except Exception:
-                            retry_after_s = None
-
-                if status == 429:
-                    attempts += 1
-                    if attempts > max_retries:
-                        raise
-                    time.sleep(retry_after_s if retry_after_s is not None else 1.5)
-                    continue  # volver a intentar
-                # Otros errores: propagar
-                raise
+        # Selections from previous slots are never read again
+        for stale in CACHE_DIR.glob('phrase-*.json'):
+            stale.unlink()
+        _write_json_atomic(cache_path, {'index': idx, 'phrase': phrase})
+    except OSError as e:
+        logger.warning("Could not write phrase cache", path=str(cache_path), error=str(e))
+    return idx, phrase
 
 
 def main(argv: List[str]) -> int:
+    """
+    Camino legacy (--legacy): suscriptores de Netlify Forms y una misma frase por
+    hora para todos, enviada con send_via_resend_with_context.
+    """
     dry_run = "--dry-run" in argv
     test_mode = "--test" in argv or os.getenv('TEST_MODE', 'false').lower() == 'true'
 
+    # Read the clock once for the whole run
+    now = time.time()
+
     # Check if we're in sending hours (5:00 AM - 11:59 PM Peru time)
-    if not dry_run and not is_sending_hours():
+    if not dry_run and not is_sending_hours(now):
         print("[INFO] Fuera del horario de envío (5:00 AM - 11:59 PM hora de Perú). No se envían frases.")
         return 0
 
+    # Una decisión por plan para toda la ejecución
+    sending_frequencies = frozenset(frequencies_sending_now(PLAN_FREQUENCIES))
+
+    # No plan sends at this hour: skip every network call
+    if not dry_run and not sending_frequencies:
+        print("[INFO] Ningún plan tiene envío programado en esta hora. No se envían frases.")
+        return 0
+
     # Config
     form_name = os.getenv('NETLIFY_FORM_NAME', 'subscribe')
     site_id = os.getenv('NETLIFY_SITE_ID', '')
     token = os.getenv('NETLIFY_ACCESS_TOKEN', '')
     sender = os.getenv('SENDER_EMAIL', 'Frases <no-reply@example.com>')
 
-    # Load phrases from Supabase
-    try:
-        from database_phrases import load_phrases as load_phrases_from_db
-        phrases = load_phrases_from_db()  # Load from Supabase
-        if not phrases:
-            logger.error("No phrases found in Supabase database")
-            return
-    except ImportError as e:
-        logger.error("Database module not available", error=str(e))
-        return
-    except Exception as e:
-        logger.error("Error loading phrases from database", error=str(e))
-        return
-        
-    # Choose a pseudo-random phrase per hour (deterministic within the hour)
-    slot = current_hour_slot()
-    seed_bytes = hashlib.sha256(f"{slot}:{len(phrases)}".encode('utf-8')).digest()
-    seed_int = int.from_bytes(seed_bytes[:8], 'big')
-    idx = seed_int % len(phrases)
-    phrase = phrases[idx]
-    phrase_id = phrase.get('id') or f"IDX{idx}"
-    phrase_text = phrase.get('text') or ''
-
     all_subscribers: List[Dict[str, str]] = []
     
     # Test mode: use only test emails
     if test_mode:
-        test_emails = os.getenv('TEST_EMAILS', '').split(',')
-        test_emails = [email.strip() for email in test_emails if email.strip()]
+        # Strip once and dedup in a single order-preserving pass
+        test_emails = list(dict.fromkeys(
+            email for email in map(str.strip, os.getenv('TEST_EMAILS', '').split(',')) if email
+        ))
         if test_emails:
             all_subscribers = [{'email': email, 'frequency': 1} for email in test_emails]
             print(f"[TEST] Usando {len(test_emails)} emails de prueba: {test_emails}")
@@ -1345,25 +2009,49 @@ def main(argv: List[str]) -> int:
             return 0
     elif site_id and token:
         try:
-            all_subscribers = get_subscribers_from_netlify(form_name, site_id, token)
+            netlify_config = NetlifyConfig(site_id=site_id, access_token=token, form_name=form_name)
+            all_subscribers = [
+                {'email': sub.email, 'frequency': int(sub.frequency)}
+                for sub in load_subscribers_cached(netlify_config)
+            ]
         except Exception as e:
             print(f"[WARN] No se pudieron obtener suscriptores de Netlify: {e}")
     else:
         print("[INFO] NETLIFY_SITE_ID o NETLIFY_ACCESS_TOKEN no configurados; 0 suscriptores.")
 
     # Filter subscribers based on their frequency preference and optimal hours
-    recipients_with_frequency = []
-    for subscriber in all_subscribers:
-        email = subscriber['email']
-        frequency = subscriber['frequency']
-        
-        # Send if current hour is optimal for user's frequency
-        if should_send_at_current_hour(frequency):
-            recipients_with_frequency.append({'email': email, 'frequency': frequency})
+    # (set lookup per subscriber against the per-plan decision taken above)
+    recipients_with_frequency = [
+        {'email': sub['email'], 'frequency': sub['frequency']}
+        for sub in all_subscribers
+        if sub['frequency'] in sending_frequencies
+    ]
     
     # Mantener lista simple para compatibilidad
     recipients = [r['email'] for r in recipients_with_frequency]
 
+    # Sin destinatarios no hace falta elegir frase ni armar asunto/cuerpos
+    # (en dry-run se sigue para mostrar la vista previa)
+    slot = current_hour_slot(now)
+    if not dry_run and not recipients:
+        print(f"[INFO] No hay destinatarios para esta hora (slot {slot}). {len(all_subscribers)} suscriptores totales.")
+        return 0
+
+    # Choose a pseudo-random phrase per hour (deterministic within the hour)
+    try:
+        selection = select_hourly_phrase(slot)
+    except ImportError as e:
+        logger.error("Database module not available", error=str(e))
+        return
+    except Exception as e:
+        logger.error("Error loading phrases from database", error=str(e))
+        return
+    if not selection:
+        return
+    idx, phrase = selection
+    phrase_id = phrase.get('id') or f"IDX{idx}"
+    phrase_text = phrase.get('text') or ''
+
     # Ultra personal subjects that don't sound like newsletters
     subjects = [
         "Hola",
@@ -1373,7 +2061,9 @@ def main(argv: List[str]) -> int:
         "Quería compartir esto contigo"
     ]
     # Choose subject based on phrase_id for consistency but avoid promotional look
-    subject_index = hash(phrase_id) % len(subjects)
+    # (_stable_token, no hash(): el asunto entra en la clave del marcador de slot y
+    # debe ser el mismo si el job se reintenta en otro proceso)
+    subject_index = _stable_token(phrase_id) % len(subjects)
     subject = subjects[subject_index]
     
     # No generar HTML/text aquí - se hará individualmente para cada destinatario
@@ -1384,16 +2074,22 @@ def main(argv: List[str]) -> int:
         print(f"[DRY-RUN] Total suscriptores: {len(all_subscribers)}")
         print(f"[DRY-RUN] Filtrados para esta hora: {len(recipients)}")
         for sub in all_subscribers[:5]:  # Show first 5 for debugging
-            will_receive = "SI" if should_send_at_current_hour(sub['frequency']) else "NO"
+            will_receive = "SI" if sub['frequency'] in sending_frequencies else "NO"
             print(f"[DRY-RUN] {sub['email']} (cada {sub['frequency']}h) {will_receive}")
         return 0
 
-    if not recipients:
-        print(f"[INFO] No hay destinatarios para esta hora (slot {slot}). {len(all_subscribers)} suscriptores totales.")
-        return 0
+    # Skip hour slots that already went out (e.g. CI retried the job)
+    slot_key = slot_send_key(subject, str(slot), phrase_id)
+    if not test_mode:
+        rotate_sent_markers()
+        if slot_already_sent(slot_key):
+            print(f"[INFO] Ya se envió este slot ({slot}). No se reenvían frases.")
+            return 0
 
     try:
-        send_via_resend_with_context(sender, recipients_with_frequency, subject, phrase_id, phrase_text)
+        send_via_resend_with_context(sender, recipients_with_frequency, subject, phrase_id, phrase_text, slot=slot)
+        if not test_mode:
+            mark_slot_sent(slot_key)
         print(f"[OK] Enviados {len(recipients)} correos de {len(all_subscribers)} suscriptores con asunto: {subject}")
         return 0
     except Exception as e:
@@ -1402,9 +2098,8 @@ def main(argv: List[str]) -> int:
 
 
 if __name__ == "__main__":
-    # Use modernized main function with fallback to legacy
-    try:
-        raise SystemExit(main_modernized(sys.argv[1:]))
-    except Exception as e:
-        logger.error("Modernized main failed, falling back to legacy", error=str(e))
+    # El legacy main solo corre si se pide explícitamente: no es un fallback, ya que
+    # main_modernized captura sus propios errores y ambos dependen de database_phrases
+    if "--legacy" in sys.argv[1:]:
         raise SystemExit(main(sys.argv[1:]))
+    raise SystemExit(main_modernized(sys.argv[1:]))
@@ -3,8 +3,15 @@ Sistema Inteligente de Frases - Anti Repetición
 Reemplaza get_random_phrase() con lógica inteligente que previene duplicados
 COMPATIBLE con el sistema existente - CERO FRICCIÓN
 """
+import atexit
+import functools
 import os
+import queue
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from typing import Dict, List, Optional, Tuple
 from supabase import create_client
 import structlog
@@ -15,14 +22,58 @@ load_dotenv()
 
 logger = structlog.get_logger()
 
-def get_supabase_client():
-    """Get Supabase client usando la configuración existente"""
-    return create_client(
-        os.getenv('SUPABASE_URL'),
-        os.getenv('SUPABASE_KEY')
+# El catálogo de frases cambia pocas veces por semana: se reutiliza en memoria
+# durante PHRASES_CACHE_TTL_SECONDS en vez de descargarlo por cada correo
+PHRASES_CACHE_TTL_SECONDS = int(os.getenv('PHRASES_CACHE_TTL_SECONDS', '600'))
+_phrases_cache: Dict[str, object] = {}
+
+# La limpieza del historial no está en el camino del correo: corre en segundo plano.
+# Un solo hilo basta; las tareas pendientes se completan antes de que termine el proceso
+_cleanup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='phrase-history-cleanup')
+
+# HTTP/2 es opcional (pip install httpx[http2]): sin h2 se queda en HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    SUPABASE_HTTP2 = True
+except ImportError:
+    SUPABASE_HTTP2 = False
+
+def _build_supabase_http_client():
+    """Cliente httpx persistente para PostgREST: keep-alive (y HTTP/2 si está disponible)"""
+    import httpx  # dependencia de supabase
+    return httpx.Client(
+        http2=SUPABASE_HTTP2,
+        limits=httpx.Limits(max_keepalive_connections=10, max_connections=20, keepalive_expiry=40.0),
+        timeout=httpx.Timeout(10.0, connect=2.0)
     )
 
-def get_smart_phrase_for_user(user_id: str) -> Optional[Dict]:
+# lru_cache no serializa la primera llamada: sin el lock, cada hilo del pool de
+# contenido que llega antes de que termine crearía (y filtraría) su propio cliente
+_supabase_client_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _create_supabase_client():
+    url = os.getenv('SUPABASE_URL')
+    key = os.getenv('SUPABASE_KEY')
+    try:
+        from supabase import ClientOptions
+    except ImportError:
+        return create_client(url, key)
+    http_client = _build_supabase_http_client()
+    try:
+        options = ClientOptions(httpx_client=http_client)
+    except TypeError:
+        # supabase-py sin httpx_client en ClientOptions: transporte por defecto
+        http_client.close()
+        return create_client(url, key)
+    return create_client(url, key, options=options)
+
+def get_supabase_client():
+    """Get Supabase client usando la configuración existente (uno por proceso: reutiliza conexión y TLS)"""
+    with _supabase_client_lock:
+        return _create_supabase_client()
+
+def get_smart_phrase_for_user(user_id: str, plan_id: Optional[int] = None) -> Optional[Dict]:
     """
     FUNCIÓN PRINCIPAL: Obtiene una frase inteligente para el usuario
     
@@ -34,6 +85,7 @@ def get_smart_phrase_for_user(user_id: str) -> Optional[Dict]:
     
     Args:
         user_id: UUID del usuario
+        plan_id: Plan activo del usuario (opcional, se guarda en el historial)
         
     Returns:
         Dict con phrase data o None si hay error
@@ -41,6 +93,36 @@ def get_smart_phrase_for_user(user_id: str) -> Optional[Dict]:
     try:
         supabase = get_supabase_client()
         
+        # Selección + registro en una sola RPC (database/smart_phrase_functions.sql)
+        try:
+            result = supabase.rpc('get_and_record_smart_phrase', {
+                'p_user_id': user_id,
+                'p_plan_id': plan_id
+            }).execute()
+            
+            if result.data:
+                phrase_data = result.data[0]
+                phrase_result = {
+                    'id': phrase_data['phrase_id'],
+                    'text': phrase_data['phrase_text'],
+                    'author': phrase_data['phrase_author']
+                }
+                
+                logger.info(
+                    "Smart phrase selected and recorded via SQL function",
+                    user_id=user_id,
+                    phrase_id=phrase_result['id'],
+                    author=phrase_result['author']
+                )
+                
+                return phrase_result
+                
+        except Exception as rpc_error:
+            logger.debug(
+                "get_and_record_smart_phrase not available, using two-step RPC",
+                error=str(rpc_error)
+            )
+        
         # Usar la función SQL optimizada si está disponible
         try:
             result = supabase.rpc('get_smart_phrase_for_user', {'p_user_id': user_id}).execute()
@@ -54,7 +136,7 @@ def get_smart_phrase_for_user(user_id: str) -> Optional[Dict]:
                 }
                 
                 # Registrar el envío
-                record_phrase_sent(user_id, phrase_result['id'])
+                queue_phrase_sent(user_id, phrase_result['id'], plan_id)
                 
                 logger.info(
                     "Smart phrase selected via SQL function",
@@ -72,64 +154,53 @@ def get_smart_phrase_for_user(user_id: str) -> Optional[Dict]:
             )
         
         # FALLBACK: Implementación Python (si no hay función SQL)
-        return _get_smart_phrase_python_fallback(user_id, supabase)
+        return _get_smart_phrase_python_fallback(user_id, supabase, plan_id)
         
     except Exception as e:
         logger.error("Error in get_smart_phrase_for_user", user_id=user_id, error=str(e))
         # Fallback al sistema original si falla todo
         return _get_original_random_phrase()
 
-def _get_smart_phrase_python_fallback(user_id: str, supabase) -> Optional[Dict]:
+def _get_smart_phrase_python_fallback(user_id: str, supabase, plan_id: Optional[int] = None) -> Optional[Dict]:
     """
     Implementación Python del algoritmo inteligente
     Fallback si la función SQL no está disponible
     """
     try:
-        # 1. Obtener todas las frases
-        all_phrases_result = supabase.table('phrases').select('*').execute()
-        if not all_phrases_result.data:
-            logger.warning("No phrases found in database")
-            return None
-        
-        all_phrases = all_phrases_result.data
-        total_phrases = len(all_phrases)
-        
-        # 2. Obtener frases ya enviadas al usuario
-        sent_phrases_result = supabase.table('user_phrase_history').select('phrase_id').eq('user_id', user_id).eq('email_status', 'sent').execute()
-        
-        sent_phrase_ids = set()
-        if sent_phrases_result.data:
-            sent_phrase_ids = {row['phrase_id'] for row in sent_phrases_result.data}
-        
-        logger.info(
-            "Phrase analysis for user",
-            user_id=user_id,
-            total_phrases=total_phrases,
-            sent_phrases=len(sent_phrase_ids)
-        )
-        
-        # 3. Filtrar frases NO enviadas
-        unsent_phrases = [p for p in all_phrases if p['id'] not in sent_phrase_ids]
+        # 1-3. Anti-join en Postgres: una frase NO enviada, al azar (una fila por la red)
+        try:
+            unsent_result = supabase.rpc('select_unsent_random', {
+                'p_user_id': user_id,
+                'p_limit': 1
+            }).execute()
+            unsent_phrases = unsent_result.data or []
+        except Exception as rpc_error:
+            logger.debug("select_unsent_random not available, filtering in Python", error=str(rpc_error))
+            unsent_phrases = _get_unsent_phrases_client_side(user_id, supabase)
+            if unsent_phrases is None:
+                return None
         
         # 4. Si no hay frases sin enviar, reiniciar ciclo
-        if not unsent_phrases:
+        was_cycle_reset = not unsent_phrases
+        if was_cycle_reset:
             logger.info(
                 "User completed all phrases, resetting cycle",
-                user_id=user_id,
-                total_completed=len(sent_phrase_ids)
+                user_id=user_id
             )
             
-            # Opcional: limpiar historial parcialmente (mantener últimas 50)
-            _cleanup_user_history(user_id, supabase, keep_last=50)
+            # Opcional: limpiar historial parcialmente (mantener últimas 50), sin esperar
+            _cleanup_executor.submit(_cleanup_user_history, user_id, supabase, 50)
             
-            # Seleccionar aleatoriamente de todas las frases
-            unsent_phrases = all_phrases
-        
-        # 5. Seleccionar frase aleatoria de las disponibles
-        selected_phrase = random.choice(unsent_phrases)
+            # Seleccionar aleatoriamente de todas las frases (una sola fila: COUNT + offset)
+            selected_phrase = _get_original_random_phrase()
+            if not selected_phrase:
+                return None
+        else:
+            # 5. Seleccionar frase aleatoria de las disponibles
+            selected_phrase = random.choice(unsent_phrases)
         
         # 6. Registrar envío
-        record_phrase_sent(user_id, selected_phrase['id'])
+        queue_phrase_sent(user_id, selected_phrase['id'], plan_id)
         
         phrase_result = {
             'id': selected_phrase['id'],
@@ -142,7 +213,7 @@ def _get_smart_phrase_python_fallback(user_id: str, supabase) -> Optional[Dict]:
             user_id=user_id,
             phrase_id=phrase_result['id'],
             author=phrase_result['author'],
-            was_cycle_reset=len(unsent_phrases) == total_phrases
+            was_cycle_reset=was_cycle_reset
         )
         
         return phrase_result
@@ -151,7 +222,56 @@ def _get_smart_phrase_python_fallback(user_id: str, supabase) -> Optional[Dict]:
         logger.error("Error in Python fallback", user_id=user_id, error=str(e))
         return _get_original_random_phrase()
 
-def record_phrase_sent(user_id: str, phrase_id: str, plan_id: Optional[int] = None) -> bool:
+def _get_all_phrases_cached(supabase) -> List[Dict]:
+    """
+    Catálogo completo (id, text, author) con TTL de PHRASES_CACHE_TTL_SECONDS
+    Una lista vacía (error o tabla vacía) no se cachea
+    """
+    now = time.monotonic()
+    if _phrases_cache.get('expires', 0) > now:
+        return _phrases_cache['rows']
+    
+    rows = supabase.table('phrases').select('id, text, author').execute().data or []
+    if rows:
+        _phrases_cache.update(rows=rows, expires=now + PHRASES_CACHE_TTL_SECONDS)
+    return rows
+
+def _get_unsent_phrases_client_side(user_id: str, supabase) -> Optional[List[Dict]]:
+    """
+    Anti-join en Python, solo si select_unsent_random no está creada.
+    Devuelve una frase no enviada al azar en una lista ([] si ya recibió todas)
+    o None si no hay frases: como la RPC con p_limit=1.
+    """
+    # Obtener todas las frases (cacheadas en memoria, solo las columnas que se usan)
+    all_phrases = _get_all_phrases_cached(supabase)
+    if not all_phrases:
+        logger.warning("No phrases found in database")
+        return None
+    
+    # Obtener frases ya enviadas al usuario
+    sent_phrases_result = supabase.table('user_phrase_history').select('phrase_id').eq('user_id', user_id).eq('email_status', 'sent').execute()
+    sent_phrase_ids = {row['phrase_id'] for row in sent_phrases_result.data or []}
+    
+    logger.info(
+        "Phrase analysis for user",
+        user_id=user_id,
+        total_phrases=len(all_phrases),
+        sent_phrases=len(sent_phrase_ids)
+    )
+    
+    # Muestreo de reservorio (Algoritmo R, k=1): una pasada sin armar la lista de no enviadas
+    winner = None
+    seen = 0
+    for phrase in all_phrases:
+        if phrase['id'] in sent_phrase_ids:
+            continue
+        seen += 1
+        if random.randrange(seen) == 0:
+            winner = phrase
+    return [winner] if winner is not None else []
+
+def record_phrase_sent(user_id: str, phrase_id: str, plan_id: Optional[int] = None,
+                       supabase=None, sent_at: Optional[str] = None) -> bool:
     """
     Registra que una frase fue enviada a un usuario
     
@@ -159,12 +279,15 @@ def record_phrase_sent(user_id: str, phrase_id: str, plan_id: Optional[int] = No
         user_id: UUID del usuario
         phrase_id: UUID de la frase
         plan_id: Plan activo del usuario (opcional)
+        supabase: cliente ya obtenido por el llamador (opcional)
+        sent_at: momento del envío en ISO 8601 (por defecto, ahora)
         
     Returns:
         True si se registró correctamente, False si hubo error
     """
     try:
-        supabase = get_supabase_client()
+        if supabase is None:
+            supabase = get_supabase_client()
         
         # Intentar usar función SQL optimizada
         try:
@@ -182,10 +305,12 @@ def record_phrase_sent(user_id: str, phrase_id: str, plan_id: Optional[int] = No
             pass
         
         # Fallback: INSERT manual con ON CONFLICT
+        # sent_at explícito: el DEFAULT de la columna no se aplica al actualizar en conflicto
         data_to_insert = {
             'user_id': user_id,
             'phrase_id': phrase_id,
-            'email_status': 'sent'
+            'email_status': 'sent',
+            'sent_at': sent_at or datetime.now(timezone.utc).isoformat()
         }
         
         if plan_id is not None:
@@ -215,17 +340,96 @@ def record_phrase_sent(user_id: str, phrase_id: str, plan_id: Optional[int] = No
         # No es crítico si falla el registro, el email se envía igual
         return False
 
+# Envíos pendientes de escribir en user_phrase_history (fuera del camino del correo).
+# Se escriben en lotes con un upsert por lote al llenarse o al terminar el proceso
+PHRASE_HISTORY_BATCH_SIZE = 50
+_phrase_history_queue: "queue.Queue[Tuple[str, str, Optional[int], str]]" = queue.Queue()
+
+def queue_phrase_sent(user_id: str, phrase_id: str, plan_id: Optional[int] = None) -> None:
+    """Encola el registro del envío (no toca la BD salvo para vaciar un lote completo)"""
+    # sent_at se fija al encolar: es el momento real del envío, no el del flush
+    sent_at = datetime.now(timezone.utc).isoformat()
+    _phrase_history_queue.put((user_id, phrase_id, plan_id, sent_at))
+    if _phrase_history_queue.qsize() >= PHRASE_HISTORY_BATCH_SIZE:
+        flush_phrase_history()
+
+def flush_phrase_history() -> int:
+    """
+    Escribe los envíos encolados con un upsert por lote (ON CONFLICT user_id, phrase_id)
+    Si el upsert en lote falla, registra uno a uno con record_phrase_sent
+    Devuelve el número de envíos registrados
+    """
+    pending = []
+    while True:
+        try:
+            pending.append(_phrase_history_queue.get_nowait())
+        except queue.Empty:
+            break
+    if not pending:
+        return 0
+    
+    # Filas con y sin plan_id por separado: un upsert en lote usa las mismas columnas
+    # para todas, y sin plan_id no se debe pisar el plan ya guardado.
+    # sent_at va explícito: en conflicto el upsert no aplica el DEFAULT now() de la columna
+    with_plan = [
+        {'user_id': u, 'phrase_id': p, 'email_status': 'sent', 'sent_at': at, 'plan_id': plan}
+        for u, p, plan, at in pending if plan is not None
+    ]
+    without_plan = [
+        {'user_id': u, 'phrase_id': p, 'email_status': 'sent', 'sent_at': at}
+        for u, p, plan, at in pending if plan is None
+    ]
+    
+    recorded = 0
+    for rows in (with_plan, without_plan):
+        for i in range(0, len(rows), PHRASE_HISTORY_BATCH_SIZE):
+            batch = rows[i:i + PHRASE_HISTORY_BATCH_SIZE]
+            try:
+                get_supabase_client().table('user_phrase_history').upsert(
+                    batch,
+                    on_conflict='user_id,phrase_id'
+                ).execute()
+                recorded += len(batch)
+            except Exception as e:
+                logger.warning("Batched phrase history write failed, recording one by one",
+                               batch_size=len(batch), error=str(e))
+                for row in batch:
+                    recorded += record_phrase_sent(row['user_id'], row['phrase_id'], row.get('plan_id'),
+                                                   sent_at=row['sent_at'])
+    
+    logger.info("Phrase deliveries recorded", queued=len(pending), recorded=recorded)
+    return recorded
+
+# Último lote pendiente al terminar el proceso
+atexit.register(flush_phrase_history)
+
 def _cleanup_user_history(user_id: str, supabase, keep_last: int = 50):
     """
     Limpia el historial de un usuario manteniendo solo los últimos N registros
     Esto previene que la tabla crezca indefinidamente
     """
     try:
+        # Un solo DELETE en Postgres (database/smart_phrase_functions.sql)
+        try:
+            result = supabase.rpc('cleanup_user_history', {
+                'p_user_id': user_id,
+                'p_keep_last': keep_last
+            }).execute()
+            logger.info(
+                "User history cleaned up",
+                user_id=user_id,
+                deleted_count=result.data if isinstance(result.data, int) else None,
+                kept_count=keep_last
+            )
+            return
+        except Exception as rpc_error:
+            logger.debug("cleanup_user_history not available, deleting in batches", error=str(rpc_error))
+        
         # Obtener IDs de registros a mantener
         keep_records = supabase.table('user_phrase_history').select('id').eq('user_id', user_id).order('sent_at', desc=True).limit(keep_last).execute()
         
         if keep_records.data and len(keep_records.data) >= keep_last:
-            keep_ids = [record['id'] for record in keep_records.data]
+            keep_ids = {record['id'] for record in keep_records.data}
             
             # Eliminar registros antiguos (mantener solo los últimos keep_last)
             # Nota: Supabase no soporta NOT IN directamente, usamos lógica inversa
@@ -234,12 +438,11 @@ def _cleanup_user_history(user_id: str, supabase, keep_last: int = 50):
             if all_user_records.data:
                 delete_ids = [record['id'] for record in all_user_records.data if record['id'] not in keep_ids]
                 
-                # Eliminar en batches para evitar timeouts
+                # Eliminar en batches para evitar timeouts: un DELETE ... IN por batch
                 batch_size = 50
                 for i in range(0, len(delete_ids), batch_size):
                     batch_ids = delete_ids[i:i + batch_size]
-                    for delete_id in batch_ids:
-                        supabase.table('user_phrase_history').delete().eq('id', delete_id).execute()
+                    supabase.table('user_phrase_history').delete().in_('id', batch_ids).execute()
                 
                 logger.info(
                     "User history cleaned up",
@@ -272,11 +475,8 @@ def get_smart_phrase_for_user_with_plan(user_id: str, plan_id: int) -> Optional[
     Versión extendida que considera el plan del usuario
     Útil para analytics y personalización futura
     """
-    phrase = get_smart_phrase_for_user(user_id)
-    if phrase:
-        # Re-registrar con plan_id para analytics
-        record_phrase_sent(user_id, phrase['id'], plan_id)
-    return phrase
+    # plan_id se guarda en el mismo registro del envío (sin un segundo upsert)
+    return get_smart_phrase_for_user(user_id, plan_id)
 
 def get_random_phrase_smart() -> Optional[Dict]:
     """
@@ -298,19 +498,28 @@ def get_user_phrase_stats(user_id: str) -> Dict:
     try:
         supabase = get_supabase_client()
         
-        # Total de frases disponibles
-        total_phrases = supabase.table('phrases').select('*', count='exact').execute()
-        total_count = total_phrases.count or 0
-        
-        # Frases recibidas por el usuario
-        user_phrases = supabase.table('user_phrase_history').select('*', count='exact').eq('user_id', user_id).eq('email_status', 'sent').execute()
-        received_count = user_phrases.count or 0
-        
-        # Última frase recibida
-        last_phrase = None
-        if user_phrases.data:
-            last_phrase_record = max(user_phrases.data, key=lambda x: x['sent_at'])
-            last_phrase = last_phrase_record['sent_at']
+        # Conteos y último envío agregados en Postgres (database/smart_phrase_functions.sql)
+        try:
+            result = supabase.rpc('get_user_phrase_stats', {'p_user_id': user_id}).execute()
+            row = result.data[0] if result.data else {}
+            total_count = row.get('total_phrases') or 0
+            received_count = row.get('phrases_received') or 0
+            last_phrase = row.get('last_sent_at')
+        except Exception as rpc_error:
+            logger.debug("get_user_phrase_stats RPC not available, counting via PostgREST", error=str(rpc_error))
+            
+            # Total de frases disponibles: del catálogo en memoria si está vigente,
+            # si no solo el conteo, sin traer filas
+            if _phrases_cache.get('expires', 0) > time.monotonic():
+                total_count = len(_phrases_cache['rows'])
+            else:
+                total_phrases = supabase.table('phrases').select('id', count='exact').limit(1).execute()
+                total_count = total_phrases.count or 0
+            
+            # Frases recibidas por el usuario + última frase recibida (una fila)
+            user_phrases = supabase.table('user_phrase_history').select('sent_at', count='exact').eq('user_id', user_id).eq('email_status', 'sent').order('sent_at', desc=True).limit(1).execute()
+            received_count = user_phrases.count or 0
+            last_phrase = user_phrases.data[0]['sent_at'] if user_phrases.data else None
         
         completion_percentage = (received_count / max(total_count, 1)) * 100
         
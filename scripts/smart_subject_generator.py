@@ -3,9 +3,10 @@ Sistema Inteligente de Generación de Asuntos para Emails
 Genera asuntos únicos y naturales usando OpenAI API con fallback robusto
 COMPATIBLE con el sistema existente - CERO FRICCIÓN
 """
+import functools
 import os
-import hashlib
-from typing import Optional, List, Dict
+import threading
+from typing import Optional, Dict
 import structlog
 from dotenv import load_dotenv
 
@@ -23,6 +24,17 @@ MAX_SUBJECT_LENGTH = 50
 DEFAULT_TEMPERATURE = 0.8
 DEFAULT_MAX_TOKENS = 20
 
+# Cliente HTTP de OpenAI compartido: conexiones keep-alive para los hilos que generan asuntos
+OPENAI_TIMEOUT_SECONDS = 10.0
+OPENAI_CONNECT_TIMEOUT_SECONDS = 5.0
+OPENAI_MAX_CONNECTIONS = 20
+OPENAI_MAX_RETRIES = 3
+_OPENAI_API_KEY: Optional[str] = os.getenv('OPENAI_API_KEY')
+
+# Asuntos ya generados por (frase, autor, momento del día): la misma frase en la
+# misma franja no vuelve a pagar una llamada a OpenAI durante el proceso
+SUBJECT_CACHE_SIZE = 4096
+
 
 # =====================================================
 # FUNCIÓN PRINCIPAL - OPENAI INTEGRATION  
@@ -50,20 +62,34 @@ def generate_smart_subject_with_openai(
         }
     """
     
+    # Verificar configuración de OpenAI antes de preparar nada
+    _get_openai_api_key()
+    
     # Determinar contexto temporal
     time_context = _get_time_context(hour_peru)
+    return _generate_subject_for_context(phrase_text, author, time_context)
+
+def _get_openai_api_key() -> str:
+    """
+    OPENAI_API_KEY leída una vez al importar; solo se vuelve a consultar el entorno
+    mientras falte. Lanza ValueError si no está configurada (es requerida)
+    """
+    global _OPENAI_API_KEY
+    if not _OPENAI_API_KEY:
+        _OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+        if not _OPENAI_API_KEY:
+            raise ValueError("OPENAI_API_KEY is required but not found in environment variables")
+    return _OPENAI_API_KEY
+
+def _generate_subject_for_context(phrase_text: str, author: str, time_context: str) -> Dict[str, any]:
+    """Llamada a OpenAI para un contexto temporal ya resuelto (ver generate_smart_subject_with_openai)"""
     
     # Verificar configuración de OpenAI (requerida)
-    api_key = os.getenv('OPENAI_API_KEY')
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY is required but not found in environment variables")
+    api_key = _get_openai_api_key()
     
     try:
-        # Importar OpenAI solo cuando se necesita
-        from openai import OpenAI
-        
-        # Crear cliente OpenAI (nueva API v1.x)
-        client = OpenAI(api_key=api_key)
+        # Cliente OpenAI del proceso (nueva API v1.x): reutiliza conexión y TLS
+        client = _get_openai_client(api_key)
         
         # Construir prompt optimizado
         prompt = _build_optimized_prompt(phrase_text, author, time_context)
@@ -118,6 +144,34 @@ def generate_smart_subject_with_openai(
 # FUNCIONES DE APOYO - OPENAI
 # =====================================================
 
+# Los hilos del pool de contenido piden el cliente a la vez: lru_cache no serializa
+# la primera llamada, el lock evita crear un cliente (y un pool httpx) por hilo
+_openai_client_lock = threading.Lock()
+
+def _get_openai_client(api_key: str):
+    """Un cliente OpenAI por API key y proceso, con pool de conexiones keep-alive"""
+    with _openai_client_lock:
+        return _create_openai_client(api_key)
+
+@functools.lru_cache(maxsize=4)
+def _create_openai_client(api_key: str):
+    # Importar OpenAI solo cuando se necesita (httpx llega como dependencia de openai)
+    import httpx
+    from openai import OpenAI
+    
+    return OpenAI(
+        api_key=api_key,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=httpx.Client(
+            limits=httpx.Limits(
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                keepalive_expiry=60.0
+            ),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+        )
+    )
+
 def _get_time_context(hour_peru: int) -> str:
     """Determina contexto temporal para el prompt"""
     if 5 <= hour_peru < 12:
@@ -129,48 +183,6 @@ def _get_time_context(hour_peru: int) -> str:
 
 def _build_optimized_prompt(phrase_text: str, author: str, time_context: str) -> str:
     """Construye prompt simplificado y directo para GPT-5 nano"""
-    
-    # Extraer palabras clave principales
-    frase_words = phrase_text.lower().split()
-    key_words = [word.strip('.,!?') for word in frase_words if len(word.strip('.,!?')) > 4][:3]
-    
-    # Buscar conceptos específicos
-    concepts = {
-        'dinero': ['dinero', 'riqueza', 'comprar', 'económico'],
-        'trabajo': ['trabajo', 'carrera', 'laboral', 'profesional'],
-        'miedo': ['miedo', 'fallar', 'intentar', 'riesgo'],
-        'música': ['música', 'ritmo', 'sonido', 'canción'],
-        'amor': ['amor', 'corazón', 'sentir', 'amar'],
-        'vida': ['vida', 'vivir', 'existir', 'mundo'],
-        'éxito': ['éxito', 'lograr', 'alcanzar', 'ganar'],
-        'felicidad': ['felicidad', 'alegría', 'sonreír', 'feliz']
-    }
-    
-    detected_theme = "general"
-    for theme, words in concepts.items():
-        if any(word in phrase_text.lower() for word in words):
-            detected_theme = theme
-            break
-    
-    # Templates específicos por tema
-    templates = {
-        'dinero': ["Más que dinero", "Tu verdadera riqueza", "Valor real", "Riqueza interior"],
-        'trabajo': ["Tu carrera espera", "Trabajo con propósito", "Tu futuro laboral", "Profesión y pasión"],
-        'miedo': ["Sin miedo hoy", "Atrévete ahora", "Coraje para actuar", "Supera tus límites"],
-        'música': ["Ritmo de vida", "Música que inspira", "Sonido del alma", "Armonía personal"],
-        'amor': ["Amor que transforma", "Corazón abierto", "Amor verdadero", "Sentimientos reales"],
-        'vida': ["Vive plenamente", "Tu vida cuenta", "Existir con sentido", "Vida auténtica"],
-        'éxito': ["Éxito personal", "Logra más", "Tu momento brillante", "Alcanza tus metas"],
-        'felicidad': ["Felicidad genuina", "Alegría interior", "Sonríe hoy", "Tu felicidad"],
-        'general': ["Reflexiona hoy", "Tu momento", "Para ti", "Algo importante"]
-    }
-    
-    import hashlib
-    # Usar hash para selección determinística pero variada
-    phrase_hash = int(hashlib.md5(phrase_text.encode()).hexdigest()[:8], 16)
-    template_options = templates.get(detected_theme, templates['general'])
-    selected_template = template_options[phrase_hash % len(template_options)]
-    
     return f"""Crea un asunto de email natural y conversacional de máximo 40 caracteres para esta frase:
 
 "{phrase_text}"
@@ -285,8 +297,13 @@ def generate_subject_for_email(phrase_text: str, author: str, hour_peru: int) ->
     Retorna solo el asunto (string) para integración fácil
     Lanza excepción si OpenAI falla
     """
-    result = generate_smart_subject_with_openai(phrase_text, author, hour_peru)
-    return result['subject']
+    _get_openai_api_key()
+    return _cached_subject(phrase_text, author, _get_time_context(hour_peru))
+
+@functools.lru_cache(maxsize=SUBJECT_CACHE_SIZE)
+def _cached_subject(phrase_text: str, author: str, time_context: str) -> str:
+    """Asunto memoizado por (frase, autor, contexto); los errores no se cachean"""
+    return _generate_subject_for_context(phrase_text, author, time_context)['subject']
 
 # Alias para compatibilidad
 get_smart_subject = generate_subject_for_email
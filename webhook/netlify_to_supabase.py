@@ -42,6 +42,10 @@ def after_request(response):
     response.headers['Access-Control-Max-Age'] = '3600'
     return response
 
+# Sesión HTTP compartida para descargar los certificados de Google al verificar
+# tokens: reutiliza la conexión keep-alive entre logins en vez de abrir una por request
+_google_http_session = requests.Session()
+
 # Initialize Supabase client
 def get_supabase():
     """Get Supabase client"""
@@ -615,13 +619,15 @@ def handle_google_signin():
         # Verify JWT token from Google using Google's official method
         try:
             from google.oauth2 import id_token
-            from google.auth.transport import requests
+            from google.auth.transport import requests as google_requests
             
             # Your Google client ID
             CLIENT_ID = "970302400473-3umkhto0uhqs08p5njnhbm90in9lcp49.apps.googleusercontent.com"
             
             # Verify the token with Google's official verification
-            idinfo = id_token.verify_oauth2_token(credential, requests.Request(), CLIENT_ID)
+            idinfo = id_token.verify_oauth2_token(
+                credential, google_requests.Request(session=_google_http_session), CLIENT_ID
+            )
             
             # Verify the issuer
             if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']: